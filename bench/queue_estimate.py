@@ -0,0 +1,96 @@
+"""
+ModuBot: A modular discord bot with dependency management
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The MIT License (MIT)
+
+Copyright (c) 2019 TheerapakG
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import sys
+import random
+import argparse
+from collections import deque
+from timeit import Timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bot.structures import IndexedQueue
+
+class Entry:
+    def __init__(self, duration):
+        self.duration = duration
+
+def linear_weight_until_item(entries, item):
+    # what estimating the time until an entry cost before the queue was indexed
+    total = 0
+    for entry in entries:
+        if entry is item:
+            return total
+        total += entry.duration
+    return total
+
+def linear_index(entries, item):
+    for i, entry in enumerate(entries):
+        if entry is item:
+            return i
+    raise ValueError('item is not in queue')
+
+def measure(stmt, lookups, repeat):
+    '''
+    best time of a single lookup, stmt does lookups of them
+    '''
+    number = max(1, 200 // lookups)
+    return min(Timer(stmt).repeat(repeat=repeat, number=number)) / number / lookups
+
+def main():
+    parser = argparse.ArgumentParser(description='time queue position and time estimates of IndexedQueue against walking a deque')
+    parser.add_argument('--size', type=int, default=10000, help='entries in the queue')
+    parser.add_argument('--lookups', type=int, default=200, help='lookups per measurement')
+    parser.add_argument('--repeat', type=int, default=5, help='measurements, the best one is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    entries = [Entry(rng.randint(60, 600)) for _ in range(args.size)]
+    queue = IndexedQueue(entries, weight = lambda entry: entry.duration)
+    linear = deque(entries)
+    targets = [rng.choice(entries) for _ in range(args.lookups)]
+    last = entries[-1]
+
+    for item in targets + [last]:
+        assert queue.weight_until_item(item) == linear_weight_until_item(linear, item)
+        assert queue.index(item) == linear_index(linear, item)
+
+    print('{} entries, best of {}, microseconds per lookup'.format(args.size, args.repeat))
+    print('{:<28} {:>10} {:>10} {:>8}'.format('', 'indexed', 'linear', 'speedup'))
+    cases = [
+        ('weight until last entry', 1, lambda: queue.weight_until_item(last), lambda: linear_weight_until_item(linear, last)),
+        ('weight until random entry', len(targets), lambda: [queue.weight_until_item(item) for item in targets], lambda: [linear_weight_until_item(linear, item) for item in targets]),
+        ('index of random entry', len(targets), lambda: [queue.index(item) for item in targets], lambda: [linear_index(linear, item) for item in targets]),
+    ]
+    for label, lookups, indexed, walked in cases:
+        fast = measure(indexed, lookups, args.repeat)
+        slow = measure(walked, lookups, args.repeat)
+        print('{:<28} {:>10.2f} {:>10.2f} {:>7.0f}x'.format(label, fast * 1e6, slow * 1e6, slow / fast))
+
+if __name__ == '__main__':
+    main()
@@ -71,6 +71,17 @@ class Config:
 
         self.debug_level = config.get('Bot', 'DebugLevel', fallback=ConfigDefaults.debug_level)
 
+        self.download_concurrency = config.getint('Music', 'DownloadConcurrency', fallback=ConfigDefaults.download_concurrency)
+        self.download_concurrency_per_guild = config.getint('Music', 'DownloadConcurrencyPerGuild', fallback=ConfigDefaults.download_concurrency_per_guild)
+        self.hot_cache_size = config.getint('Music', 'HotCacheSize', fallback=ConfigDefaults.hot_cache_size)
+        self.hot_cache_after = config.getint('Music', 'HotCacheAfter', fallback=ConfigDefaults.hot_cache_after)
+        self.info_cache_ttl = config.getint('Music', 'InfoCacheTTL', fallback=ConfigDefaults.info_cache_ttl)
+        self.info_cache_stream_ttl = config.getint('Music', 'InfoCacheStreamTTL', fallback=ConfigDefaults.info_cache_stream_ttl)
+        self.extract_processes = config.getint('Music', 'ExtractProcesses', fallback=ConfigDefaults.extract_processes)
+        self.audio_cache_size = config.getint('Music', 'AudioCacheSize', fallback=ConfigDefaults.audio_cache_size)
+        self.search_cache_size = config.getint('Music', 'SearchCacheSize', fallback=ConfigDefaults.search_cache_size)
+        self.search_cache_ttl = config.getint('Music', 'SearchCacheTTL', fallback=ConfigDefaults.search_cache_ttl)
+
         self.run_checks()
 
     def run_checks(self):
@@ -104,6 +115,46 @@ class Config:
             log.warning("Invalid DebugLevel option \"{}\" given, falling back to INFO".format(self.debug_level))
             self.debug_level = logging.INFO
 
+        if self.download_concurrency < 2:
+            log.warning("DownloadConcurrency must be at least 2, falling back to {}".format(ConfigDefaults.download_concurrency))
+            self.download_concurrency = ConfigDefaults.download_concurrency
+
+        if self.download_concurrency_per_guild < 1:
+            log.warning("DownloadConcurrencyPerGuild must be at least 1, falling back to {}".format(ConfigDefaults.download_concurrency_per_guild))
+            self.download_concurrency_per_guild = ConfigDefaults.download_concurrency_per_guild
+
+        if self.hot_cache_size < 0:
+            log.warning("HotCacheSize must not be negative, falling back to {}".format(ConfigDefaults.hot_cache_size))
+            self.hot_cache_size = ConfigDefaults.hot_cache_size
+
+        if self.hot_cache_after < 1:
+            log.warning("HotCacheAfter must be at least 1, falling back to {}".format(ConfigDefaults.hot_cache_after))
+            self.hot_cache_after = ConfigDefaults.hot_cache_after
+
+        if self.info_cache_ttl < 0:
+            log.warning("InfoCacheTTL must not be negative, falling back to {}".format(ConfigDefaults.info_cache_ttl))
+            self.info_cache_ttl = ConfigDefaults.info_cache_ttl
+
+        if self.info_cache_stream_ttl < 0:
+            log.warning("InfoCacheStreamTTL must not be negative, falling back to {}".format(ConfigDefaults.info_cache_stream_ttl))
+            self.info_cache_stream_ttl = ConfigDefaults.info_cache_stream_ttl
+
+        if self.extract_processes < 0:
+            log.warning("ExtractProcesses must not be negative, falling back to {}".format(ConfigDefaults.extract_processes))
+            self.extract_processes = ConfigDefaults.extract_processes
+
+        if self.audio_cache_size < 0:
+            log.warning("AudioCacheSize must not be negative, falling back to {}".format(ConfigDefaults.audio_cache_size))
+            self.audio_cache_size = ConfigDefaults.audio_cache_size
+
+        if self.search_cache_size < 0:
+            log.warning("SearchCacheSize must not be negative, falling back to {}".format(ConfigDefaults.search_cache_size))
+            self.search_cache_size = ConfigDefaults.search_cache_size
+
+        if self.search_cache_ttl < 0:
+            log.warning("SearchCacheTTL must not be negative, falling back to {}".format(ConfigDefaults.search_cache_ttl))
+            self.search_cache_ttl = ConfigDefaults.search_cache_ttl
+
 class ConfigDefaults:
     owner_id = None
 
@@ -112,4 +163,15 @@ class ConfigDefaults:
     command_prefix = '!'
     debug_level = 'DEBUG'
 
+    download_concurrency = 4
+    download_concurrency_per_guild = 2
+    hot_cache_size = 512
+    hot_cache_after = 2
+    info_cache_ttl = 604800
+    info_cache_stream_ttl = 3600
+    extract_processes = 0
+    audio_cache_size = 0
+    search_cache_size = 256
+    search_cache_ttl = 3600
+
     config_file = 'config/config.ini'
\ No newline at end of file
@@ -0,0 +1,186 @@
+"""
+ModuBot: A modular discord bot with dependency management
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The MIT License (MIT)
+
+Copyright (c) 2019 TheerapakG
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from collections import deque
+from discord import AudioSource
+import threading
+
+_UNREAD = object()
+
+class _Producer:
+    '''
+    a source shared by several cursors, frames that were read from it are kept in a window
+    so that cursors a bit behind the one reading ahead get them without reading the source
+    '''
+    def __init__(self, source, frame, live, window):
+        self._source = source
+        self._frames = deque(maxlen = window)
+        self._base = frame
+        self._ended = False
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self.live = live
+        self.opus = source.is_opus()
+        self.subscribers = 0
+
+    @property
+    def head(self):
+        return self._base + len(self._frames)
+
+    @property
+    def ended(self):
+        return self._ended
+
+    def has(self, frame):
+        with self._lock:
+            return self._base <= frame < self.head or (frame == self.head and not self._ended)
+
+    def _buffered(self, frame):
+        with self._lock:
+            if frame < self._base:
+                return None
+            if frame < self.head:
+                return self._frames[frame - self._base]
+            if self._ended:
+                return b''
+            return _UNREAD
+
+    def get(self, frame):
+        '''
+        frame at index frame, or None if it has already left the window
+        '''
+        data = self._buffered(frame)
+        if data is not _UNREAD:
+            return data
+
+        with self._read_lock:
+            # another cursor may have read it while waiting for the lock
+            data = self._buffered(frame)
+            if data is not _UNREAD:
+                return data
+
+            data = self._source.read()
+            with self._lock:
+                if not data:
+                    self._ended = True
+                else:
+                    if len(self._frames) == self._frames.maxlen:
+                        self._base += 1
+                    self._frames.append(data)
+            return data
+
+    def close(self):
+        self._source.cleanup()
+
+class SharedSourceCursor(AudioSource):
+    '''
+    a player's own read position on a source that may be shared with other players
+    '''
+    def __init__(self, hub, key, offset, create, live):
+        self._hub = hub
+        self._key = key
+        self._create = create
+        self._live = live
+        self._producer, self.frame = hub._join(key, offset, create, live)
+        self._index = self.frame
+        self._closed = False
+
+    def read(self):
+        data = self._producer.get(self._index)
+        if data is None:
+            # fell out of the window, e.g. after a long pause, so continue on another source
+            self._hub._leave(self._key, self._producer)
+            self._producer, self._index = self._hub._join(self._key, self._index * 0.02, self._create, self._live)
+            data = self._producer.get(self._index)
+        if data:
+            self._index += 1
+        return data
+
+    def is_opus(self):
+        return self._producer.opus
+
+    def cleanup(self):
+        if not self._closed:
+            self._closed = True
+            self._hub._leave(self._key, self._producer)
+
+class FanoutHub:
+    '''
+    decodes a source once for every player that plays it from about the same position
+
+    sources are identified by a key that has to include everything that changes the frames,
+    e.g. the file and the volume filter. a player starting at offset joins a source of the
+    same key that still holds that frame in its window of `window` frames (20ms each) and
+    reads it behind the player that started it, otherwise a new source is created. live
+    sources (streams) are joined at whatever frame they are at, so any number of guilds can
+    follow one radio stream
+    '''
+    def __init__(self, window = 500):
+        self.window = window
+        self._producers = dict()
+        self._lock = threading.Lock()
+
+    def subscribe(self, key, offset, create, *, live = False) -> SharedSourceCursor:
+        '''
+        cursor reading the source of key from offset seconds, create(offset) is called to
+        open the source when there is none to join
+        '''
+        return SharedSourceCursor(self, key, offset, create, live)
+
+    def _join(self, key, offset, create, live):
+        frame = int(offset / 0.02)
+        with self._lock:
+            for producer in self._producers.get(key, ()):
+                if (live and not producer.ended) or (not live and producer.has(frame)):
+                    producer.subscribers += 1
+                    return producer, (producer.head if live else frame)
+
+        # spawning the source can block, so it is done outside of the lock
+        producer = _Producer(create(offset), frame, live, self.window)
+        with self._lock:
+            producer.subscribers += 1
+            self._producers.setdefault(key, list()).append(producer)
+        return producer, frame
+
+    def _leave(self, key, producer):
+        with self._lock:
+            producer.subscribers -= 1
+            if producer.subscribers:
+                return
+            self._producers[key].remove(producer)
+            if not self._producers[key]:
+                del self._producers[key]
+        producer.close()
+
+    def stats(self):
+        with self._lock:
+            producers = [producer for producers in self._producers.values() for producer in producers]
+            return {
+                'sources': len(producers),
+                'cursors': sum(producer.subscribers for producer in producers)
+            }
+
+shared_sources = FanoutHub()
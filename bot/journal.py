@@ -0,0 +1,98 @@
+"""
+ModuBot: A modular discord bot with dependency management
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The MIT License (MIT)
+
+Copyright (c) 2019 TheerapakG
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import json
+
+class PlaylistJournal:
+    '''
+    append-only log of playlist mutations on top of a periodic snapshot
+
+    each line of the journal is one json encoded operation, the snapshot holds the whole
+    list of serialized entries. the journal is folded into a new snapshot and truncated
+    every `compact_every` operations. operations carry a sequence number so that the ones
+    already in the snapshot are skipped if the journal was not truncated after it
+    '''
+    def __init__(self, path, *, compact_every = 1000):
+        self._snapshot_path = '{}.snapshot'.format(path)
+        self._journal_path = '{}.journal'.format(path)
+        self._compact_every = compact_every
+        self._ops = 0
+        self._seq = 0
+        os.makedirs(os.path.dirname(self._journal_path) or '.', exist_ok=True)
+        self._fp = None
+
+    def load(self):
+        '''
+        (serialized entries of the snapshot, operations logged after it)
+        '''
+        entries = list()
+        if os.path.isfile(self._snapshot_path):
+            with open(self._snapshot_path, 'r') as fp:
+                snapshot = json.load(fp)
+            entries = snapshot['entries']
+            self._seq = snapshot['seq']
+
+        ops = list()
+        if os.path.isfile(self._journal_path):
+            with open(self._journal_path, 'r') as fp:
+                for line in fp:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        # torn write at the end of the journal
+                        break
+                    if op['seq'] > self._seq:
+                        ops.append(op)
+                        self._seq = op['seq']
+        self._ops = len(ops)
+        return entries, ops
+
+    def append(self, op):
+        if not self._fp:
+            self._fp = open(self._journal_path, 'a')
+        self._seq += 1
+        op['seq'] = self._seq
+        self._fp.write(json.dumps(op))
+        self._fp.write('\n')
+        self._fp.flush()
+        self._ops += 1
+
+    def should_compact(self):
+        return self._ops >= self._compact_every
+
+    def snapshot(self, entries):
+        with open('{}.part'.format(self._snapshot_path), 'w') as fp:
+            fp.write(json.dumps({'seq': self._seq, 'entries': entries}))
+        os.replace('{}.part'.format(self._snapshot_path), self._snapshot_path)
+        self.close()
+        open(self._journal_path, 'w').close()
+        self._ops = 0
+
+    def close(self):
+        if self._fp:
+            self._fp.close()
+            self._fp = None
@@ -0,0 +1,234 @@
+"""
+ModuBot: A modular discord bot with dependency management
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The MIT License (MIT)
+
+Copyright (c) 2019 TheerapakG
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import defaultdict, OrderedDict
+
+# files in the cache folder that are not (finished) audio
+_ignored = ('.part', '.ytdl', '.json', '.temp', '.tmp')
+
+class AudioCacheIndex:
+    '''
+    names of the audio files in the cache folder, so that checking whether an entry is
+    cached needs no listdir. files are found by their name, their name without extension,
+    or their name without the hash suffix that generic downloads get
+
+    with a budget the least recently used files are removed once the cache holds more than
+    budget bytes, files derived from a download (returned by companions) count towards its
+    size and are removed with it. names hardlinked to the same audio count its bytes once,
+    which are only freed when the last of them is removed
+
+    the index is kept next to the folder together with the folder's mtime and is only
+    trusted if the folder did not change since it was saved, otherwise the folder is
+    scanned again
+    '''
+    def __init__(self, folder, budget=0, companions=None):
+        self.folder = folder
+        self.budget = budget
+        self._companions = companions or (lambda name: [])
+        self._path = '{}.index.json'.format(folder.rstrip(os.sep))
+        # name -> [size, last use, size of companions, inode], least recently used first
+        self._files = OrderedDict()
+        # inode -> number of names linking to it
+        self._links = defaultdict(int)
+        self._by_stem = defaultdict(set)
+        self._by_prefix = defaultdict(set)
+        self._lock = threading.Lock()
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.evicted_bytes = 0
+
+        files = None
+        try:
+            with open(self._path, 'r') as fp:
+                data = json.load(fp)
+            if data['mtime'] == os.stat(folder).st_mtime_ns and all(len(value) == 4 for value in data['files'].values()):
+                files = data['files']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        scanned = files is None
+        if scanned:
+            files = dict()
+            for f in os.scandir(folder):
+                if f.is_file() and not f.name.endswith(_ignored):
+                    stat = f.stat()
+                    files[f.name] = [stat.st_size, stat.st_mtime, self._companion_size(f.name), f.inode()]
+
+        for name, (size, used, extra, inode) in sorted(files.items(), key=lambda item: item[1][1]):
+            self._add(name, size, used, extra, inode)
+
+        if scanned:
+            self.save()
+
+    def _companion_size(self, name):
+        size = 0
+        for path in self._companions(name):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def _add(self, name, size, used, extra, inode):
+        self._remove(name)
+        self._files[name] = [size, used, extra, inode]
+        self._links[inode] += 1
+        self.total += extra + (size if self._links[inode] == 1 else 0)
+        self._by_stem[name.rsplit('.', 1)[0]].add(name)
+        self._by_prefix[name.rsplit('-', 1)[0]].add(name)
+
+    def _remove(self, name):
+        '''
+        forget name, returns the bytes this frees
+        '''
+        if name not in self._files:
+            return 0
+        size, _, extra, inode = self._files.pop(name)
+        self._links[inode] -= 1
+        if self._links[inode]:
+            size = 0
+        else:
+            del self._links[inode]
+        self.total -= extra + size
+        for index, key in ((self._by_stem, name.rsplit('.', 1)[0]), (self._by_prefix, name.rsplit('-', 1)[0])):
+            index[key].discard(name)
+            if not index[key]:
+                del index[key]
+        return extra + size
+
+    def add(self, name):
+        '''
+        add name or update its size after its companions changed
+        '''
+        stat = os.stat(os.path.join(self.folder, name))
+        extra = self._companion_size(name)
+        with self._lock:
+            self._add(name, stat.st_size, time.time(), extra, stat.st_ino)
+
+    def remove(self, name):
+        with self._lock:
+            return self._remove(name)
+
+    def record_hit(self, name):
+        with self._lock:
+            self.hits += 1
+            if name in self._files:
+                self._files[name][1] = time.time()
+                self._files.move_to_end(name)
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def _checked(self, name):
+        # files can be removed behind the bot's back, which is one stat instead of a listdir
+        if name and not os.path.isfile(os.path.join(self.folder, name)):
+            self.remove(name)
+            return None
+        return name
+
+    def find(self, name):
+        '''
+        name if it is in the cache, else None
+        '''
+        with self._lock:
+            found = name if name in self._files else None
+        return self._checked(found)
+
+    def find_stem(self, stem):
+        '''
+        a file called stem with any extension
+        '''
+        with self._lock:
+            found = next(iter(self._by_stem.get(stem, ())), None)
+        return self._checked(found)
+
+    def find_prefix(self, prefix):
+        '''
+        a file called prefix followed by a hash suffix
+        '''
+        with self._lock:
+            found = next(iter(self._by_prefix.get(prefix, ())), None)
+        return self._checked(found)
+
+    def evict(self, keep=()):
+        '''
+        remove least recently used files until the cache fits into the budget, names in keep
+        are never removed. returns the removed names
+        '''
+        victims = []
+        with self._lock:
+            if not self.budget or self.total <= self.budget:
+                return victims
+            excess = self.total - self.budget
+            # links left per inode once the victims so far are gone
+            links = dict()
+            for name, (size, _, extra, inode) in self._files.items():
+                if excess <= 0:
+                    break
+                if name not in keep:
+                    victims.append(name)
+                    links[inode] = links.get(inode, self._links[inode]) - 1
+                    excess -= extra + (size if not links[inode] else 0)
+
+        for name in victims:
+            for path in [os.path.join(self.folder, name)] + self._companions(name):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            with self._lock:
+                self.evicted += 1
+                self.evicted_bytes += self._remove(name)
+        return victims
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._files),
+                'bytes': self.total,
+                'budget': self.budget,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evicted': self.evicted,
+                'evicted_bytes': self.evicted_bytes
+            }
+
+    def __len__(self):
+        return len(self._files)
+
+    def save(self):
+        with self._lock:
+            files = {name: list(value) for name, value in self._files.items()}
+        with open('{}.part'.format(self._path), 'w') as fp:
+            fp.write(json.dumps({'mtime': os.stat(self.folder).st_mtime_ns, 'files': files}))
+        os.replace('{}.part'.format(self._path), self._path)
@@ -0,0 +1,176 @@
+"""
+ModuBot: A modular discord bot with dependency management
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The MIT License (MIT)
+
+Copyright (c) 2019 TheerapakG
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import json
+import threading
+from hashlib import md5
+
+class StreamingHasher:
+    '''
+    youtube_dl progress hook that hashes downloads while they are written, each call reads
+    what was appended to the .part file since the last one, which is still in the page
+    cache. the digest of a finished download is taken out with pop
+    '''
+    def __init__(self):
+        self._files = dict()
+        self._digests = dict()
+        self._lock = threading.Lock()
+
+    def __call__(self, status):
+        filename = status.get('filename')
+        if not filename:
+            return
+
+        with self._lock:
+            state = self._files.get(filename)
+
+        if status['status'] == 'error':
+            if state:
+                state[1].close()
+                with self._lock:
+                    self._files.pop(filename, None)
+            return
+
+        if not state:
+            # downloads youtube_dl skips because the file exists only report finished
+            path = status.get('tmpfilename', filename) if status['status'] == 'downloading' else filename
+            try:
+                state = [md5(), open(path, 'rb')]
+            except OSError:
+                return
+            with self._lock:
+                self._files[filename] = state
+
+        if status.get('downloaded_bytes') is not None and status['downloaded_bytes'] < state[1].tell():
+            # the download started over
+            state[0] = md5()
+            state[1].seek(0)
+
+        # the handle stays valid when the .part file is renamed to filename
+        for chunk in iter(lambda: state[1].read(65536), b''):
+            state[0].update(chunk)
+
+        if status['status'] == 'finished':
+            state[1].close()
+            with self._lock:
+                self._files.pop(filename, None)
+                self._digests[filename] = state[0].hexdigest()
+
+    def pop(self, filename):
+        with self._lock:
+            return self._digests.pop(filename, None)
+
+class ContentStore:
+    '''
+    downloads filed by the md5 of their content in folder/objects, files in the audio cache
+    are hardlinks to these so that the same audio fetched from different urls is stored once.
+    an object no file links to anymore is removed, the url and file name -> hash index is
+    persisted in the objects folder
+    '''
+    def __init__(self, folder):
+        self.folder = os.path.join(folder, 'objects')
+        os.makedirs(self.folder, exist_ok=True)
+        self._path = os.path.join(self.folder, 'index.json')
+        self._lock = threading.Lock()
+        self.deduplicated = 0
+        self.saved_bytes = 0
+        try:
+            with open(self._path, 'r') as fp:
+                data = json.load(fp)
+            self._urls = data['urls']
+            self._names = data['names']
+        except (OSError, ValueError, KeyError):
+            self._urls = dict()
+            self._names = dict()
+        self.collect()
+
+    def _object(self, digest):
+        return os.path.join(self.folder, digest)
+
+    def hash_of(self, url):
+        return self._urls.get(url)
+
+    def store(self, url, path, digest):
+        '''
+        file the download of url at path under digest, if the same content is stored already
+        path is replaced by a link to it
+        '''
+        name = os.path.basename(path)
+        obj = self._object(digest)
+        try:
+            if not os.path.isfile(obj):
+                os.link(path, obj)
+            elif not os.path.samefile(obj, path):
+                size = os.path.getsize(path)
+                os.link(obj, '{}.link'.format(path))
+                os.replace('{}.link'.format(path), path)
+                with self._lock:
+                    self.deduplicated += 1
+                    self.saved_bytes += size
+        except OSError:
+            # no hardlinks on this filesystem, the file simply stays where it is
+            return
+        with self._lock:
+            self._urls[url] = digest
+            self._names[name] = digest
+
+    def release(self, name):
+        '''
+        forget the file name, which was deleted, and remove its object if nothing else links to it
+        '''
+        with self._lock:
+            digest = self._names.pop(name, None)
+        if not digest:
+            return
+        try:
+            if os.stat(self._object(digest)).st_nlink <= 1:
+                os.unlink(self._object(digest))
+        except FileNotFoundError:
+            pass
+
+    def collect(self):
+        '''
+        remove objects nothing links to, left behind when the index was not saved
+        '''
+        for f in os.scandir(self.folder):
+            if f.name != 'index.json' and not f.name.endswith('.part') and f.stat().st_nlink <= 1:
+                os.unlink(f.path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'urls': len(self._urls),
+                'deduplicated': self.deduplicated,
+                'saved_bytes': self.saved_bytes
+            }
+
+    def save(self):
+        with self._lock:
+            data = {'urls': dict(self._urls), 'names': dict(self._names)}
+        with open('{}.part'.format(self._path), 'w') as fp:
+            fp.write(json.dumps(data))
+        os.replace('{}.part'.format(self._path), self._path)
@@ -0,0 +1,144 @@
+"""
+ModuBot: A modular discord bot with dependency management
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The MIT License (MIT)
+
+Copyright (c) 2019 TheerapakG
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit
+from youtube_dl.extractor import gen_extractor_classes, get_info_extractor
+
+_extractors = None
+
+@lru_cache(maxsize = 4096)
+def normalize(url, ie_key = None):
+    '''
+    (extractor id, video id) for urls an extractor recognizes, so that every way of
+    writing the same video shares a key, and the url without its fragment otherwise
+
+    matching url against every extractor takes milliseconds, so results are memoized and
+    ie_key, the extractor that handles url if the caller knows it, is tried first
+    '''
+    global _extractors
+    if _extractors is None:
+        _extractors = gen_extractor_classes()
+
+    url = url.strip()
+    if ie_key and ie_key != 'Generic':
+        try:
+            ie = get_info_extractor(ie_key)
+            if ie.suitable(url):
+                return ie.ie_key(), ie._match_id(url)
+        except Exception:
+            pass
+
+    for ie in _extractors:
+        if ie.suitable(url):
+            if ie.ie_key() != 'Generic':
+                try:
+                    return ie.ie_key(), ie._match_id(url)
+                except Exception:
+                    pass
+            break
+
+    parts = urlsplit(url)
+    if not parts.scheme:
+        # search strings and the like
+        return 'Generic', url
+    return 'Generic', urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ''))
+
+class InfoCache:
+    '''
+    results of extract_info without downloading kept in sqlite, so that resolving the same
+    url again needs no network round-trip
+
+    unprocessed results only hold metadata and are kept for ttl seconds. processed results
+    carry media urls that expire, as does everything about a live stream, so those are kept
+    for stream_ttl seconds only
+    '''
+    def __init__(self, path, ttl = 7 * 24 * 60 * 60, stream_ttl = 60 * 60):
+        self.ttl = ttl
+        self.stream_ttl = stream_ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread = False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, info TEXT NOT NULL, expires REAL NOT NULL)')
+        self._db.execute('DELETE FROM info WHERE expires < ?', (time.time(),))
+        self._db.commit()
+
+    @staticmethod
+    def _key(url, process, ie_key):
+        return json.dumps(list(normalize(url, ie_key)) + [bool(process)])
+
+    def get(self, url, process = True, ie_key = None):
+        '''
+        cached info of url or None, this blocks on sqlite and is meant to be run in an executor
+        '''
+        key = self._key(url, process, ie_key)
+        with self._lock:
+            row = self._db.execute('SELECT info, expires FROM info WHERE key = ?', (key,)).fetchone()
+            if row and row[1] < time.time():
+                self._db.execute('DELETE FROM info WHERE key = ?', (key,))
+                self._db.commit()
+                self.expired += 1
+                row = None
+            if not row:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, url, process, info, ie_key = None):
+        if not info:
+            return
+        try:
+            data = json.dumps(info)
+        except (TypeError, ValueError):
+            # unprocessed playlists may hold generators
+            return
+        ttl = self.stream_ttl if process or info.get('is_live') else self.ttl
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO info (key, info, expires) VALUES (?, ?, ?)',
+                (self._key(url, process, ie_key), data, time.time() + ttl)
+            )
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute('SELECT COUNT(*) FROM info').fetchone()[0]
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses, 'expired': self.expired}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,141 @@
+"""
+ModuBot: A modular discord bot with dependency management
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The MIT License (MIT)
+
+Copyright (c) 2019 TheerapakG
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import re
+import json
+import asyncio
+import subprocess
+import threading
+from hashlib import md5
+from concurrent.futures import ProcessPoolExecutor
+from ...utils import worker_context
+
+regex_integrated = re.compile(r'I:\s+(-?[\d.]+|-inf) LUFS')
+regex_peak = re.compile(r'Peak:\s+(-?[\d.]+|-inf) dBFS')
+
+def fingerprint(path, chunk=65536):
+    '''
+    hash of the size, head and tail of a file, enough to tell cached files apart
+    without reading all of them
+    '''
+    size = os.path.getsize(path)
+    fhash = md5(str(size).encode())
+    with open(path, 'rb') as fp:
+        fhash.update(fp.read(chunk))
+        if size > chunk:
+            fp.seek(max(chunk, size - chunk))
+            fhash.update(fp.read(chunk))
+    return fhash.hexdigest()
+
+def analyze(path):
+    '''
+    integrated loudness (LUFS) and true peak (dBFS) of path using ffmpeg's ebur128 filter,
+    meant to be run in a worker process
+    '''
+    result = subprocess.run(
+        ['ffmpeg', '-nostdin', '-hide_banner', '-nostats', '-i', path, '-vn', '-af', 'ebur128=peak=true', '-f', 'null', '-'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    output = result.stderr.decode(errors='replace')
+    summary = output[output.rfind('Summary:'):]
+    integrated = regex_integrated.search(summary)
+    peak = regex_peak.search(summary)
+    if result.returncode or not integrated:
+        raise Exception('ffmpeg could not analyze {}'.format(path))
+    return {
+        'integrated': float(integrated.group(1)),
+        'peak': float(peak.group(1)) if peak else None
+    }
+
+class LoudnessIndex:
+    '''
+    loudness of cached files, analyzed once in a process pool and persisted in a sidecar
+    file keyed by file fingerprint so that replaying a file never analyzes it again
+    '''
+    target = -16.0
+    max_boost = 10.0
+    peak_ceiling = -1.0
+
+    def __init__(self, bot, folder, workers=1):
+        self._bot = bot
+        self._path = os.path.join(folder, 'loudness.json')
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=worker_context())
+        self._pending = dict()
+        self._save_lock = threading.Lock()
+        try:
+            with open(self._path, 'r') as fp:
+                self._index = json.load(fp)
+        except (OSError, ValueError):
+            self._index = dict()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+    def _gain(self, result):
+        if result['integrated'] == float('-inf'):
+            return 1.0
+        gain_db = min(self.target - result['integrated'], self.max_boost)
+        if result['peak'] is not None and result['peak'] != float('-inf'):
+            gain_db = min(gain_db, self.peak_ceiling - result['peak'])
+        return 10 ** (gain_db / 20)
+
+    def _save(self, index):
+        with self._save_lock:
+            with open('{}.part'.format(self._path), 'w') as fp:
+                fp.write(json.dumps(index))
+            os.replace('{}.part'.format(self._path), self._path)
+
+    async def cached_gain(self, path):
+        '''
+        (fingerprint, gain) of path, gain is None if path has not been analyzed yet
+        '''
+        key = await self._bot.loop.run_in_executor(None, fingerprint, path)
+        if key in self._index:
+            return key, self._gain(self._index[key])
+        return key, None
+
+    async def get_gain(self, path, key=None):
+        '''
+        linear gain that brings path to the target loudness, analyzing it if this is the first time
+        '''
+        if not key:
+            key = await self._bot.loop.run_in_executor(None, fingerprint, path)
+        if key in self._index:
+            return self._gain(self._index[key])
+
+        if key not in self._pending:
+            self._pending[key] = self._bot.loop.run_in_executor(self._pool, analyze, path)
+        try:
+            result = await asyncio.shield(self._pending[key])
+        finally:
+            if key in self._pending and self._pending[key].done():
+                del self._pending[key]
+
+        self._index[key] = result
+        await self._bot.loop.run_in_executor(None, self._save, dict(self._index))
+        return self._gain(result)
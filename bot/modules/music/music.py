@@ -50,16 +50,21 @@ DEALINGS IN THE SOFTWARE.
 from discord.ext.commands import Cog, command
 from asyncio import create_task, Lock
 import traceback
-from ...rich_guild import get_guild
+from ...rich_guild import get_guild, get_guild_list
 from ...decorator_helper import decorate_cog_command
 from ...playback import Entry, Playlist
-from ...utils import fixg, ftimedelta
-from .ytdldownloader import YtdlDownloader, YtdlStreamEntry, get_entry, get_stream_entry, get_entry_list_from_playlist_url
+from ...scheduler import CacheScheduler
+from ...segments import hot_tracks
+from ...utils import fixg, ftimedelta, parse_duration
+from .infocache import InfoCache
+from .searchcache import SearchCache
+from .ytdldownloader import YtdlDownloader, YtdlStreamEntry, get_entry, get_stream_entry, playlist_length, iter_entries_from_playlist, entry_from_serialized, result_url
 from collections import defaultdict
 from ...playback import PlayerState
 from datetime import timedelta
 import time
 import re
+import os
 
 from typing import Optional, Union, Set
 
@@ -70,12 +75,57 @@ class Music(Cog):
         self._aiolocks = defaultdict(Lock)
         self.bot = None
         self.downloader = None
+        self.cache_scheduler = None
         self.lockdowntier = 0
         self._playlists = dict()
 
     async def pre_init(self, bot):
         self.bot = bot
-        self.downloader = YtdlDownloader(self.bot, 'audio_cache')
+        info_cache = None
+        if self.bot.config.info_cache_ttl:
+            info_cache = InfoCache(
+                os.path.join('data', 'info_cache.sqlite3'),
+                ttl = self.bot.config.info_cache_ttl,
+                stream_ttl = self.bot.config.info_cache_stream_ttl
+            )
+        search_cache = None
+        if self.bot.config.search_cache_size and self.bot.config.search_cache_ttl:
+            search_cache = SearchCache(
+                size = self.bot.config.search_cache_size,
+                ttl = self.bot.config.search_cache_ttl
+            )
+        self.downloader = YtdlDownloader(
+            self.bot,
+            'audio_cache',
+            download_workers = self.bot.config.download_concurrency,
+            info_cache = info_cache,
+            extract_processes = self.bot.config.extract_processes,
+            cache_size = self.bot.config.audio_cache_size * 1024 * 1024,
+            in_use = self._entries_in_use,
+            search_cache = search_cache
+        )
+        self.cache_scheduler = CacheScheduler(
+            max_concurrent = self.bot.config.download_concurrency,
+            max_per_group = self.bot.config.download_concurrency_per_guild
+        )
+        if self.bot.config.hot_cache_size:
+            hot_tracks.configure(
+                os.path.join(self.downloader.download_folder, 'segments'),
+                self.bot.config.hot_cache_size * 1024 * 1024,
+                self.bot.config.hot_cache_after
+            )
+
+    async def _entries_in_use(self):
+        entries = []
+        for playlist in self._playlists.values():
+            entries.extend(await playlist.get_entries())
+        for guild in get_guild_list(self.bot).values():
+            try:
+                player = await guild.get_player()
+            except Exception:
+                continue
+            entries.extend(await player.get_loaded_entries())
+        return entries
 
     async def init(self):
         self.bot.crossmodule.assign_dict_object('PermType', 'canSummon', bool)
@@ -117,7 +167,41 @@ class Music(Cog):
         self.bot.crossmodule.assign_dict_object('DefaultPerm', 'maxEntryLength', timedelta(minutes=60))
         self.bot.crossmodule.assign_dict_object('DefaultPerm', 'lockdownTier', 0)
 
+    async def on_ready(self):
+        # bring back every journaled playlist so their queues are ready before anyone summons
+        if os.path.isdir(os.path.join('data', 'playlists')):
+            for fname in os.listdir(os.path.join('data', 'playlists')):
+                if fname.endswith('.snapshot'):
+                    self._get_playlist(fname[:-len('.snapshot')])
+
+    def _load_entry(self, data):
+        channel = self.bot.get_channel(data['channel_id']) if data.get('channel_id') else None
+        return entry_from_serialized(data, self.downloader, {'channel': channel})
+
+    def _get_playlist(self, playlistname):
+        if playlistname not in self._playlists:
+            self._playlists[playlistname] = Playlist(
+                playlistname,
+                self.bot,
+                persistent = True,
+                scheduler = self.cache_scheduler,
+                loader = self._load_entry
+            )
+        return self._playlists[playlistname]
+
     async def uninit(self):
+        self.bot.log.debug('stopping players...')
+        for guild in get_guild_list(self.bot).values():
+            try:
+                player = await guild.get_player()
+            except Exception:
+                continue
+            # the playing and the upcoming entry go back to the head of their playlist with
+            # their resume offset, so that the journal still has them after the restart
+            try:
+                await player.kill()
+            except Exception as e:
+                self.bot.log.warning('cannot stop player: {}'.format(e))
         self.bot.log.debug('stopping downloader...')
         self.downloader.shutdown()
         self.bot.log.debug('stopping playlists...')
@@ -151,9 +235,7 @@ class Music(Cog):
                 await guild.set_connected_voice_channel(voicechannel)
                 if not before_player:
                     playlistname = 'default-{}'.format(guild.id)
-                    if playlistname not in self._playlists:
-                        self._playlists[playlistname] = Playlist(ctx.bot, playlistname)
-                    await guild.set_playlist(self._playlists[playlistname])
+                    await guild.set_playlist(self._get_playlist(playlistname))
             await ctx.send('successfully summoned')
 
     @command()
@@ -239,6 +321,32 @@ class Music(Cog):
             await player.skip()
             await ctx.send('successfully skipped')
 
+    @command()
+    @decorate_cog_command('require_perm_cog_command', 'canControlPlayback', True)
+    async def seek(self, ctx, position: str):
+        """
+        Usage:
+            {prefix}seek position
+
+        jump to position in the current entry, position can be given as
+        seconds, [hh:]mm:ss or a duration such as 1m30s
+        """
+        try:
+            if ':' in position:
+                seconds = sum(float(part) * 60 ** i for i, part in enumerate(reversed(position.split(':'))))
+            else:
+                seconds = float(position)
+        except ValueError:
+            try:
+                seconds = parse_duration(position).total_seconds()
+            except AssertionError:
+                raise Exception('`{}` is not a valid position'.format(position))
+
+        guild = get_guild(ctx.bot, ctx.guild)
+        player = await guild.get_player()
+        await player.seek(seconds)
+        await ctx.send('successfully seeked to {}'.format(ftimedelta(timedelta(seconds=seconds))))
+
     @command()
     async def remove(self, ctx, position: Optional[int] = None):
         """
@@ -265,12 +373,36 @@ class Music(Cog):
         playlist = await player.get_playlist()
         if not position:
             position = (await playlist.get_length()) - 1
-        entry = await playlist[position]
+        entry = await playlist.get_entry_at(position)
 
         if ctrlplayback_permission or (authorremove_permission and entry.queuer_id == ctx.author.id):
             await playlist.remove_position(position)
             await ctx.send('successfully removed')
 
+    @command()
+    async def queue(self, ctx, page: Optional[int] = 1):
+        """
+        Usage:
+            {prefix}queue [page]
+
+        list entries in queue, 10 entries per page
+        """
+        guild = get_guild(ctx.bot, ctx.guild)
+        player = await guild.get_player()
+        playlist = await player.get_playlist()
+        length = await playlist.get_length()
+        pages = max(1, (length + 9) // 10)
+        page = min(max(page, 1), pages)
+        entries = await playlist.get_entry_at(slice((page - 1) * 10, page * 10))
+
+        lines = ['`{}.` **{}** ({})'.format(
+            position, 
+            entry.title, 
+            ftimedelta(entry.get_duration())
+        ) for position, entry in enumerate(entries, (page - 1) * 10)]
+        lines.append('page {}/{}, {} entries in queue'.format(page, pages, length))
+        await ctx.send('\n'.join(lines))
+
     @command()
     @decorate_cog_command('require_perm_cog_command', 'canAddEntry', True)
     async def play(self, ctx, *, song_url: str):
@@ -338,7 +470,9 @@ class Music(Cog):
             async with ctx.typing():
                 # If it's playlist
                 if 'entries' in info:
-                    num_songs = sum(1 for _ in info['entries'])
+                    # lazily paged playlists are listed while they are queued, their length
+                    # is only known upfront if the extractor tells
+                    num_songs = playlist_length(info)
 
                     allow_playlists_permission =  await ctx.bot.crossmodule.async_call_object(
                         'have_perm', 
@@ -349,87 +483,115 @@ class Music(Cog):
 
                     if not allow_playlists_permission:
                         await ctx.send("You are not allowed to request playlists")
+                        return
 
-                    max_playlists_length_permission =  await ctx.bot.crossmodule.async_call_object(
-                        'have_perm', 
-                        ctx.author, 
-                        'maxPlaylistsLength', 
-                        num_songs
-                    )
+                    if num_songs is not None:
+                        max_playlists_length_permission =  await ctx.bot.crossmodule.async_call_object(
+                            'have_perm', 
+                            ctx.author, 
+                            'maxPlaylistsLength', 
+                            num_songs
+                        )
 
-                    if not max_playlists_length_permission:
-                        await ctx.send("Playlist has too many entries ({1})".format(num_songs))
+                        if not max_playlists_length_permission:
+                            await ctx.send("Playlist has too many entries ({0})".format(num_songs))
+                            return
 
                     playlist = await player.get_playlist()
 
-                    num_songs_playlist = await playlist.num_entry_of(ctx.author)
-                    total_songs = num_songs + num_songs_playlist
-
-                    max_song_count_permission =  await ctx.bot.crossmodule.async_call_object(
-                        'have_perm', 
-                        ctx.author, 
-                        'maxSongCount', 
-                        total_songs
-                    )
-
-                    if not max_song_count_permission:
-                        await ctx.send("cannot queue because song count will exceed ({1})".format(total_songs))
+                    # checked for every entry, the playlist may be longer than it says or not say at all
+                    total_songs = await playlist.num_entry_of(ctx.author.id)
 
                     t0 = time.time()
-
-                    # My test was 1.2 seconds per song, but we maybe should fudge it a bit, unless we can
-                    # monitor it and edit the message with the estimated time, but that's some ADVANCED SHIT
-                    # I don't think we can hook into it anyways, so this will have to do.
-                    # It would probably be a thread to check a few playlists and get the speed from that
-                    # Different playlists might download at different speeds though
-                    wait_per_song = 1.2
                     drop_count = 0
 
-                    procmesg = await ctx.send(
-                        'Gathering playlist information for {0} songs{1}'.format(
-                            num_songs,
-                            ', ETA: {0} seconds'.format(
-                                fixg(num_songs * wait_per_song)
-                            ) if num_songs >= 10 else '.'
-                        )
-                    )
-
-                    # TODO: I can create an event emitter object instead, add event functions, and every play list might be asyncified
-                    #       Also have a "verify_entry" hook with the entry as an arg and returns the entry if its ok
+                    if num_songs is None:
+                        procmesg = await ctx.send('Gathering playlist information.')
+                    else:
+                        procmesg = await ctx.send('Gathering playlist information for {0} songs.'.format(num_songs))
 
-                    entry_list = await get_entry_list_from_playlist_url(song_url, ctx.author.id, self.downloader, {'channel':ctx.channel})
+                    # entries are queued as soon as they are resolved, so the first one can be
+                    # precached while the rest of the playlist is still being gathered
                     entry = None
                     position = None
-                    for entry_proc in entry_list:
-                        duration = entry_proc.get_duration()
-                        max_entry_length_permission =  await ctx.bot.crossmodule.async_call_object(
-                            'have_perm', 
-                            ctx.author, 
-                            'maxEntryLength', 
-                            duration
-                        )
-                        if not max_entry_length_permission:
+                    listlen = 0
+                    last_progress = t0
+                    async for entry_proc in iter_entries_from_playlist(info, ctx.author.id, self.downloader, {'channel':ctx.channel}):
+                        if num_songs is None:
+                            # the length was not known upfront, so it is checked as the playlist is listed
+                            max_playlists_length_permission =  await ctx.bot.crossmodule.async_call_object(
+                                'have_perm', 
+                                ctx.author, 
+                                'maxPlaylistsLength', 
+                                listlen + 1
+                            )
+                            if not max_playlists_length_permission:
+                                await ctx.send("Playlist has too many entries, only the first {0} were processed".format(listlen))
+                                break
+                        listlen += 1
+                        if entry_proc:
+                            duration = entry_proc.get_duration()
+                            max_entry_length_permission =  await ctx.bot.crossmodule.async_call_object(
+                                'have_perm', 
+                                ctx.author, 
+                                'maxEntryLength', 
+                                duration
+                            )
+                            max_song_count_permission =  await ctx.bot.crossmodule.async_call_object(
+                                'have_perm', 
+                                ctx.author, 
+                                'maxSongCount', 
+                                total_songs + 1
+                            )
+                            if not max_song_count_permission:
+                                # the rest of the playlist would not fit either
+                                drop_count += 1
+                                await ctx.send("cannot queue more songs because song count will exceed ({0})".format(total_songs + 1))
+                                break
+                            elif not max_entry_length_permission:
+                                drop_count += 1
+                            else:
+                                total_songs += 1
+                                position_potent = await playlist.add_entry(entry_proc)
+                                if not position:
+                                    entry = entry_proc
+                                    position = position_potent
+                                    # tell right away that the first song is on its way
+                                    last_progress = 0
+                        else:
                             drop_count += 1
-                            continue
-                        position_potent = await playlist.add_entry(entry_proc)
-                        if not position:
-                            entry = entry_proc
-                            position = position_potent
+
+                        # editing is rate limited by discord
+                        if time.time() - last_progress > 2:
+                            last_progress = time.time()
+                            if num_songs is None:
+                                await procmesg.edit(content = 'Gathering playlist information: {} songs, {} enqueued'.format(
+                                    listlen,
+                                    listlen - drop_count
+                                ))
+                            else:
+                                await procmesg.edit(content = 'Gathering playlist information: {}/{} songs, {} enqueued, ETA: {} seconds'.format(
+                                    listlen,
+                                    num_songs,
+                                    listlen - drop_count,
+                                    fixg((last_progress - t0) / listlen * max(num_songs - listlen, 0))
+                                ))
 
                     tnow = time.time()
                     ttime = tnow - t0
-                    listlen = len(entry_list)
 
-                    ctx.bot.log.info("Processed {} songs in {} seconds at {:.2f}s/song, {:+.2g}/song from expected ({}s)".format(
+                    ctx.bot.log.info("Processed {} songs in {} seconds at {:.2f}s/song".format(
                         listlen,
                         fixg(ttime),
-                        ttime / listlen if listlen else 0,
-                        ttime / listlen - wait_per_song if listlen - wait_per_song else 0,
-                        fixg(wait_per_song * num_songs))
-                    )
+                        ttime / listlen if listlen else 0
+                    ))
 
                     await procmesg.delete()
 
+                    if not entry:
+                        await ctx.send("None of the songs in that playlist can be played.")
+                        return
+
                     reply_text = "Enqueued **%s** songs to be played. Position of the first entry in queue: %s"
                     btext = str(listlen - drop_count)
 
@@ -437,7 +599,7 @@ class Music(Cog):
                 else:
                     playlist = await player.get_playlist()
 
-                    num_songs_playlist = await playlist.num_entry_of(ctx.author)
+                    num_songs_playlist = await playlist.num_entry_of(ctx.author.id)
                     total_songs = 1 + num_songs_playlist
 
                     max_song_count_permission =  await ctx.bot.crossmodule.async_call_object(
@@ -450,7 +612,7 @@ class Music(Cog):
                     if not max_song_count_permission:
                         await ctx.send("cannot queue because song count will exceed ({1})".format(total_songs))
 
-                    entry = await get_entry(song_url, ctx.author.id, self.downloader, {'channel':ctx.channel})
+                    entry = await get_entry(song_url, ctx.author.id, self.downloader, {'channel':ctx.channel}, info)
                     duration = entry.get_duration()
                     max_entry_length_permission =  await ctx.bot.crossmodule.async_call_object(
                         'have_perm', 
@@ -477,6 +639,42 @@ class Music(Cog):
 
         await ctx.send(reply_text)
 
+    @command()
+    async def search(self, ctx, *, query: str):
+        """
+        Usage:
+            {command_prefix}search text to search for
+
+        Lists the top results of a search, any of them can then be added with the play command.
+        """
+
+        bypass_lockdown_permission =  await ctx.bot.crossmodule.async_call_object(
+            'have_perm', 
+            ctx.author, 
+            'lockdownTier', 
+            self.lockdowntier,
+        )
+
+        if not bypass_lockdown_permission:
+            await ctx.send("You do not have permission to interact with the bot due to lockdown.")
+            return
+
+        results = await self.downloader.search(query.strip())
+        if not results:
+            await ctx.send('No results for that search.')
+            return
+
+        lines = []
+        for position, item in enumerate(results, 1):
+            duration = item.get('duration')
+            lines.append('{}. {}{} <{}>'.format(
+                position,
+                item.get('title', 'Untitled'),
+                ' ({})'.format(ftimedelta(timedelta(seconds=duration))) if isinstance(duration, (int, float)) else '',
+                result_url(item)
+            ))
+        await ctx.send('\n'.join(lines))
+
     @command()
     @decorate_cog_command('require_perm_cog_command', 'canAddEntry', True)
     @decorate_cog_command('require_perm_cog_command', 'canAddStream', True)
@@ -510,7 +708,7 @@ class Music(Cog):
         playlist = await player.get_playlist()
         async with ctx.typing():
             async with self._aiolocks['play_{}'.format(ctx.author.id)]:
-                num_songs_playlist = await playlist.num_entry_of(ctx.author)
+                num_songs_playlist = await playlist.num_entry_of(ctx.author.id)
                 total_songs = 1 + num_songs_playlist
 
                 max_song_count_permission =  await ctx.bot.crossmodule.async_call_object(
@@ -634,6 +832,122 @@ class Music(Cog):
 
         await ctx.send(np_text)
 
+    @command()
+    async def playbackstats(self, ctx, reset: Optional[str] = None):
+        """
+        Usage:
+            {command_prefix}playbackstats [reset]
+
+        Displays frame timing and player command latency statistics of playback in this guild.
+        Passing reset clears the statistics after displaying them.
+        """
+        guild = get_guild(ctx.bot, ctx.guild)
+        player = await guild.get_player()
+        stats = player.playback_stats()
+
+        lines = [
+            'frames: {} late: {} short: {} underruns: {}'.format(stats['frames'], stats['late'], stats['short'], stats['underruns']),
+            'stream stalls: {} reconnects: {}'.format(stats['stalls'], stats['reconnects']),
+            'worst frame read: {}ms'.format(fixg(stats['latency_max'] * 1000)),
+            'frame read: {}'.format(' '.join('{}:{}'.format(k, v) for k, v in stats['latency'].items() if v)),
+            'ffmpeg startup: {}'.format(' '.join('{}:{}'.format(k, v) for k, v in stats['startup'].items() if v)),
+        ]
+        if stats['startup_last'] is not None:
+            lines.append('last startup: {}ms'.format(fixg(stats['startup_last'] * 1000)))
+        lines.append('commands: {} slowest: {}ms'.format(stats['commands'], fixg(stats['command_max'] * 1000)))
+        lines.append('command latency: {}'.format(' '.join('{}:{}'.format(k, v) for k, v in stats['command'].items() if v)))
+        if 'shared' in stats:
+            lines.append('decoding {} sources for {} players'.format(stats['shared']['sources'], stats['shared']['cursors']))
+        if 'hot_tracks' in stats:
+            lines.append('hot tracks: {} cached in {}MB'.format(stats['hot_tracks']['segments'], fixg(stats['hot_tracks']['size'] / 1024 / 1024)))
+
+        if reset == 'reset':
+            player.reset_playback_stats()
+            lines.append('statistics reset')
+
+        await ctx.send('```\n{}\n```'.format('\n'.join(lines)))
+
+    @command()
+    async def downloadstats(self, ctx):
+        """
+        Usage:
+            {command_prefix}downloadstats
+
+        Displays running downloads and how fast each extractor downloaded recently.
+        """
+        lines = []
+        for progress in self.downloader.downloads.values():
+            lines.append('{}: {}{} at {}KiB/s, ETA: {}'.format(
+                progress.title,
+                '{}% of '.format(fixg(progress.fraction * 100)) if progress.fraction is not None else '',
+                '{}MB'.format(fixg((progress.total or progress.downloaded) / 1024 / 1024)),
+                fixg((progress.speed or 0) / 1024),
+                '{}s'.format(progress.eta) if progress.eta is not None else 'unknown'
+            ))
+        if not lines:
+            lines.append('no running downloads')
+
+        for extractor, stats in sorted(self.downloader.throughput.stats().items()):
+            lines.append('{}: {} downloads, {}KiB/s, {}x realtime'.format(
+                extractor,
+                stats['downloads'],
+                fixg(stats['speed'] / 1024),
+                fixg(stats['realtime']) if stats['realtime'] else '?'
+            ))
+
+        await ctx.send('```\n{}\n```'.format('\n'.join(lines)))
+
+    @command()
+    async def cachestats(self, ctx):
+        """
+        Usage:
+            {command_prefix}cachestats
+
+        Displays how often url information was served from the info cache, searches from the
+        search cache and downloads from the audio cache.
+        """
+        lines = []
+        if self.downloader.info_cache:
+            stats = self.downloader.info_cache.stats()
+            lookups = stats['hits'] + stats['misses']
+            lines.append('info cache: entries: {} hits: {} misses: {} (expired: {}) hit rate: {}%'.format(
+                stats['entries'],
+                stats['hits'],
+                stats['misses'],
+                stats['expired'],
+                fixg(stats['hits'] * 100 / lookups) if lookups else 0
+            ))
+        else:
+            lines.append('info cache: disabled')
+
+        if self.downloader.search_cache:
+            stats = self.downloader.search_cache.stats()
+            lookups = stats['hits'] + stats['misses']
+            lines.append('search cache: queries: {} hits: {} misses: {} hit rate: {}%'.format(
+                stats['entries'],
+                stats['hits'],
+                stats['misses'],
+                fixg(stats['hits'] * 100 / lookups) if lookups else 0
+            ))
+        else:
+            lines.append('search cache: disabled')
+
+        stats = self.downloader.cache_index.stats()
+        lookups = stats['hits'] + stats['misses']
+        lines.append('audio cache: {} files in {}MB{} hits: {} misses: {} hit rate: {}%'.format(
+            stats['files'],
+            fixg(stats['bytes'] / 1024 / 1024),
+            ' of {}MB'.format(fixg(stats['budget'] / 1024 / 1024)) if stats['budget'] else '',
+            stats['hits'],
+            stats['misses'],
+            fixg(stats['hits'] * 100 / lookups) if lookups else 0
+        ))
+        lines.append('evicted: {} files, {}MB'.format(stats['evicted'], fixg(stats['evicted_bytes'] / 1024 / 1024)))
+        stats = self.downloader.content_store.stats()
+        lines.append('deduplicated: {} files, {}MB saved'.format(stats['deduplicated'], fixg(stats['saved_bytes'] / 1024 / 1024)))
+
+        await ctx.send('```\n{}\n```'.format('\n'.join(lines)))
+
     @command()
     async def volume(self, ctx, new_volume:Optional[str] = None):
         """
@@ -0,0 +1,116 @@
+"""
+ModuBot: A modular discord bot with dependency management
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The MIT License (MIT)
+
+Copyright (c) 2019 TheerapakG
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import time
+from collections import defaultdict, deque
+
+class ProgressReporter:
+    '''
+    youtube_dl progress hook that passes the state of downloads on to send, at most once
+    every interval seconds per file while downloading
+    '''
+    keys = ('filename', 'status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'speed', 'eta')
+
+    def __init__(self, send, interval=0.5):
+        self._send = send
+        self._interval = interval
+        self._last = dict()
+
+    def __call__(self, status):
+        filename = status.get('filename')
+        if not filename:
+            return
+        now = time.monotonic()
+        if status['status'] == 'downloading':
+            if now - self._last.get(filename, 0) < self._interval:
+                return
+            self._last[filename] = now
+        else:
+            self._last.pop(filename, None)
+        self._send({key: status.get(key) for key in self.keys})
+
+class DownloadProgress:
+    '''
+    bytes, speed and eta of one download as reported by youtube_dl
+    '''
+    def __init__(self, title, extractor):
+        self.title = title
+        self.extractor = extractor
+        self.status = 'starting'
+        self.downloaded = 0
+        self.total = None
+        self.speed = None
+        self.eta = None
+        self.started = time.monotonic()
+
+    def update(self, status):
+        self.status = status['status']
+        self.downloaded = status.get('downloaded_bytes') or self.downloaded
+        self.total = status.get('total_bytes') or status.get('total_bytes_estimate') or self.total
+        self.speed = status.get('speed')
+        self.eta = status.get('eta')
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def fraction(self):
+        if not self.total:
+            return None
+        return min(self.downloaded / self.total, 1.0)
+
+class ThroughputStats:
+    '''
+    download throughput of each extractor over its last window downloads, in bytes and in
+    seconds of audio per second
+    '''
+    def __init__(self, window=20):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, extractor, size, duration, seconds):
+        self._samples[extractor].append((size, duration, max(seconds, 0.001)))
+
+    def realtime(self, extractor):
+        '''
+        seconds of audio extractor downloads per second, None before its first download
+        '''
+        samples = self._samples.get(extractor)
+        if not samples:
+            return None
+        duration = sum(sample[1] for sample in samples)
+        return duration / sum(sample[2] for sample in samples) if duration else None
+
+    def stats(self):
+        stats = dict()
+        for extractor, samples in self._samples.items():
+            seconds = sum(sample[2] for sample in samples)
+            stats[extractor] = {
+                'downloads': len(samples),
+                'speed': sum(sample[0] for sample in samples) / seconds,
+                'realtime': self.realtime(extractor)
+            }
+        return stats
@@ -0,0 +1,80 @@
+"""
+ModuBot: A modular discord bot with dependency management
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The MIT License (MIT)
+
+Copyright (c) 2019 TheerapakG
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+def normalize_query(query):
+    '''
+    key of a text search, queries that only differ in case or whitespace share it
+    '''
+    return ' '.join(query.casefold().split())
+
+class SearchCache:
+    '''
+    results of text searches by normalized query, so that a popular query asked for again,
+    in any guild, needs no search. results expire after ttl seconds and only the size most
+    recently used queries are kept
+    '''
+    def __init__(self, size = 256, ttl = 60 * 60):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # normalized query -> (expires, number of results asked for, results)
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query, count):
+        '''
+        at least count results of query if that many were searched for and have not expired, else None
+        '''
+        key = normalize_query(query)
+        with self._lock:
+            found = self._results.get(key)
+            if not found or found[0] < time.time() or found[1] < count:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return found[2][:count]
+
+    def put(self, query, count, results):
+        key = normalize_query(query)
+        with self._lock:
+            self._results[key] = (time.time() + self.ttl, count, results)
+            self._results.move_to_end(key)
+            while len(self._results) > self.size:
+                self._results.popitem(last = False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._results),
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -48,16 +48,24 @@ DEALINGS IN THE SOFTWARE.
 """
 
 import os
+import json
 import asyncio
 import functools
+import threading
 import youtube_dl
-from ...playback import Entry
-from ...utils import get_header, md5sum
+from ...playback import Entry, transcode_opus, load_ogg_index, default_volume
+from ...utils import get_header, md5sum, worker_context
+from .loudness import LoudnessIndex
+from .cacheindex import AudioCacheIndex
+from .contentstore import StreamingHasher, ContentStore
+from .infocache import InfoCache
+from .progress import ProgressReporter, DownloadProgress, ThroughputStats
 
 from urllib.error import URLError
 from youtube_dl.utils import DownloadError, UnsupportedError
 
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 ytdl_format_options = {
     'format': 'bestaudio/best',
@@ -76,6 +84,60 @@ ytdl_format_options = {
 
 youtube_dl.utils.bug_reports_message = lambda: ''
 
+_worker_ytdl = dict()
+
+# hashes downloads of this process' YoutubeDL instances while they are written
+_hasher = StreamingHasher()
+
+# download progress of a worker process goes to the bot through this queue
+_progress_queue = None
+
+def _worker_instance(params):
+    key = json.dumps(params, sort_keys=True, default=str)
+    if key not in _worker_ytdl:
+        _worker_ytdl[key] = youtube_dl.YoutubeDL(params)
+        _worker_ytdl[key].add_progress_hook(_hasher)
+        if _progress_queue:
+            _worker_ytdl[key].add_progress_hook(ProgressReporter(_progress_queue.put))
+    return _worker_ytdl[key]
+
+def _attach_digest(ytdl, info, kwargs):
+    # the md5 of a downloaded file, so that it never has to be read again to hash it
+    if info and kwargs.get('download', True) and 'entries' not in info:
+        info['content_md5'] = _hasher.pop(ytdl.prepare_filename(info))
+
+def init_worker(param_sets, progress_queue=None):
+    '''
+    build the YoutubeDL instances of a worker process up front, so that the first request
+    it gets does not pay for loading the extractors
+    '''
+    global _progress_queue
+    _progress_queue = progress_queue
+    for params in param_sets:
+        _worker_instance(params)
+
+def extract_info_in_worker(params, args, kwargs):
+    '''
+    ytdl.extract_info with a YoutubeDL of params that is kept for the lifetime of the worker
+    process, meant to be run in a process pool
+    '''
+    ytdl = _worker_instance(params)
+    info = ytdl.extract_info(*args, **kwargs)
+    _attach_digest(ytdl, info, kwargs)
+    if info and 'entries' in info and not isinstance(info['entries'], list):
+        # lazily extracted entries cannot be sent back to the bot process
+        info['entries'] = list(info['entries'])
+    return info
+
+def process_info_in_worker(params, info):
+    '''
+    ytdl.process_ie_result of info extracted with process=False, meant to be run in a process pool
+    '''
+    info = _worker_instance(params).process_ie_result(info, download=False)
+    if info and 'entries' in info and not isinstance(info['entries'], list):
+        info['entries'] = list(info['entries'])
+    return info
+
 '''
     Alright, here's the problem.  To catch youtube-dl errors for their useful information, I have to
     catch the exceptions with `ignoreerrors` off.  To not break when ytdl hits a dumb video
@@ -85,14 +147,34 @@ youtube_dl.utils.bug_reports_message = lambda: ''
 '''
 
 class YtdlDownloader:
-    def __init__(self, bot, download_folder=None):
+    def __init__(self, bot, download_folder=None, download_workers=2, info_cache=None, extract_processes=0, cache_size=0, in_use=None, search_cache=None):
         self._bot = bot
         self.thread_pool = ThreadPoolExecutor(max_workers=2)
+        # downloads get their own pool so bulk caching never starves info extraction for new requests
+        self.download_pool = ThreadPoolExecutor(max_workers=download_workers)
         self.unsafe_ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
         self.safe_ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
         self.safe_ytdl.params['ignoreerrors'] = True
+        self.unsafe_ytdl.add_progress_hook(_hasher)
+        self.safe_ytdl.add_progress_hook(_hasher)
+        reporter = ProgressReporter(lambda update: self._bot.loop.call_soon_threadsafe(self._on_progress, update))
+        self.unsafe_ytdl.add_progress_hook(reporter)
+        self.safe_ytdl.add_progress_hook(reporter)
+        # running downloads by file name, and how fast each extractor downloaded recently
+        self.downloads = dict()
+        self.throughput = ThroughputStats()
         os.makedirs(os.path.dirname('/data/{}/'.format(download_folder)), exist_ok=True)
         self.download_folder = '/data/{}'.format(download_folder)
+        self.opus_folder = os.path.join(self.download_folder, 'opus')
+        os.makedirs(self.opus_folder, exist_ok=True)
+        self.loudness = LoudnessIndex(bot, self.download_folder)
+        # files of queued and playing entries are never evicted, in_use is a coroutine listing those entries
+        self.cache_index = AudioCacheIndex(self.download_folder, cache_size, lambda name: [self.opus_path(name), '{}.idx'.format(self.opus_path(name))])
+        self.in_use = in_use
+        self.content_store = ContentStore(self.download_folder)
+        self.info_cache = info_cache
+        self.search_cache = search_cache
+        self._pending = dict()
 
         if self.download_folder:
             otmpl = self.unsafe_ytdl.params['outtmpl']
@@ -102,22 +184,158 @@ class YtdlDownloader:
             otmpl = self.safe_ytdl.params['outtmpl']
             self.safe_ytdl.params['outtmpl'] = os.path.join(self.download_folder, otmpl)
 
+        # parsing is cpu heavy python, in worker processes it does not hold the gil the event loop needs
+        self.extract_process_pool = None
+        self.download_process_pool = None
+        if extract_processes:
+            param_sets = [dict(self.unsafe_ytdl.params), dict(self.safe_ytdl.params)]
+            context = worker_context()
+            self.extract_process_pool = ProcessPoolExecutor(max_workers=extract_processes, mp_context=context, initializer=init_worker, initargs=(param_sets,))
+            self._progress_queue = context.Queue()
+            self.download_process_pool = ProcessPoolExecutor(max_workers=download_workers, mp_context=context, initializer=init_worker, initargs=(param_sets, self._progress_queue))
+            threading.Thread(target=self._forward_progress, daemon=True).start()
+
     def shutdown(self):
         self.thread_pool.shutdown()
+        self.download_pool.shutdown()
+        if self.extract_process_pool:
+            self.extract_process_pool.shutdown(wait=False)
+            self.download_process_pool.shutdown(wait=False)
+            self._progress_queue.put(None)
+        self.loudness.shutdown()
+        self.cache_index.save()
+        self.content_store.save()
+        if self.info_cache:
+            self.info_cache.close()
 
     @property
     def ytdl(self):
         return self.safe_ytdl
 
-    async def extract_info(self, *args, on_error=None, retry_on_error=False, **kwargs):
+    def _forward_progress(self):
+        for update in iter(self._progress_queue.get, None):
+            self._bot.loop.call_soon_threadsafe(self._on_progress, update)
+
+    def _on_progress(self, update):
+        progress = self.downloads.get(update['filename'])
+        if progress:
+            progress.update(update)
+
+    def estimate_download(self, filename, duration):
+        '''
+        seconds until the download of filename finishes, from its progress if it is running or
+        else from how fast its extractor downloaded lately, 0 if there is nothing to go by
+        '''
+        progress = self.downloads.get(filename)
+        if progress and progress.eta is not None:
+            return progress.eta
+        realtime = self.throughput.realtime(os.path.basename(filename).split('-')[0])
+        if not realtime:
+            return 0
+        return max(duration / realtime - (progress.elapsed if progress else 0), 0)
+
+    def opus_path(self, local_url):
+        '''
+        where the ogg/opus version of a downloaded file is kept
+        '''
+        return os.path.join(self.opus_folder, '{}.opus'.format(os.path.basename(local_url).rsplit('.', 1)[0]))
+
+    async def trim_cache(self, *keep):
+        '''
+        evict least recently played downloads until the audio cache fits into its budget
+        '''
+        index = self.cache_index
+        if not index.budget or index.total <= index.budget:
+            return
+
+        keep = set(keep)
+        if self.in_use:
+            for entry in await self.in_use():
+                if isinstance(entry, YtdlUrlEntry):
+                    keep.update(entry.cache_names())
+
+        evicted = index.evict(keep)
+        for name in evicted:
+            self.content_store.release(name)
+        if evicted:
+            self._bot.log.info("Evicted {} files from the audio cache, {} bytes cached".format(len(evicted), index.total))
+
+    def _pool_for(self, kwargs):
+        # youtube_dl downloads unless told otherwise
+        return self.download_pool if kwargs.get('download', True) else self.thread_pool
+
+    def _process_pool_for(self, kwargs):
+        return self.download_process_pool if kwargs.get('download', True) else self.extract_process_pool
+
+    def _cacheable(self, args, kwargs):
+        return self.info_cache and args and not kwargs.get('download', True)
+
+    async def _cached_info(self, args, kwargs):
+        # matching the url to its extractor and sqlite both block, neither may run on the event loop
+        return await self._bot.loop.run_in_executor(
+            None,
+            functools.partial(self.info_cache.get, args[0], kwargs.get('process', True), kwargs.get('ie_key'))
+        )
+
+    def _run_extract_info(self, ytdl, cache, *args, **kwargs):
+        info = ytdl.extract_info(*args, **kwargs)
+        _attach_digest(ytdl, info, kwargs)
+        if cache and self._cacheable(args, kwargs):
+            self.info_cache.put(args[0], kwargs.get('process', True), info, kwargs.get('ie_key'))
+        return info
+
+    async def _run_extract_info_in_process(self, ytdl, args, kwargs, cache=True):
+        info = await self._bot.loop.run_in_executor(
+            self._process_pool_for(kwargs),
+            extract_info_in_worker,
+            dict(ytdl.params),
+            args,
+            kwargs
+        )
+        if cache and self._cacheable(args, kwargs):
+            await self._bot.loop.run_in_executor(self.thread_pool, self.info_cache.put, args[0], kwargs.get('process', True), info, kwargs.get('ie_key'))
+        return info
+
+    def coalesce(self, key, coro_fn):
+        '''
+        run coro_fn once for everyone asking for key while it is running, every caller awaits
+        the same result and cancelling one of them does not cancel it for the others
+        '''
+        future = self._pending.get(key)
+        if not future:
+            future = self._pending[key] = asyncio.ensure_future(coro_fn())
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+        return asyncio.shield(future)
+
+    def _extract(self, ytdl, args, kwargs, cache=True):
+        # cache is False for callers that want a fresh result, which then does not replace the cached one
+        # requests for the same url spelled differently are not coalesced, telling them apart
+        # would mean matching the url against every extractor here on the event loop
+        url = args[0].strip() if args and isinstance(args[0], str) else None
+        key = ('info', id(ytdl), url, repr(args[1:]), repr(sorted(kwargs.items())))
+        if self.extract_process_pool:
+            return self.coalesce(key, lambda: self._run_extract_info_in_process(ytdl, args, kwargs, cache))
+        return self.coalesce(key, lambda: self._bot.loop.run_in_executor(
+            self._pool_for(kwargs),
+            functools.partial(self._run_extract_info, ytdl, cache, *args, **kwargs)
+        ))
+
+    async def extract_info(self, *args, on_error=None, retry_on_error=False, cache=True, **kwargs):
         """
             Runs ytdl.extract_info within the threadpool. Returns a future that will fire when it's done.
             If `on_error` is passed and an exception is raised, the exception will be caught and passed to
             on_error as an argument.
+            Info is served from the info cache when it has not expired, unless `cache` is False or
+            the call downloads. Info extracted with `cache` False is not stored in the cache either.
         """
+        if cache and self._cacheable(args, kwargs):
+            info = await self._cached_info(args, kwargs)
+            if info is not None:
+                return info
+
         if callable(on_error):
             try:
-                return await self._bot.loop.run_in_executor(self.thread_pool, functools.partial(self.unsafe_ytdl.extract_info, *args, **kwargs))
+                return await self._extract(self.unsafe_ytdl, args, kwargs, cache)
 
             except Exception as e:
 
@@ -133,43 +351,83 @@ class YtdlDownloader:
                     self._bot.loop.call_soon_threadsafe(on_error, e)
 
                 if retry_on_error:
-                    return await self.safe_extract_info(self._bot.loop, *args, **kwargs)
+                    return await self.safe_extract_info(*args, cache=cache, **kwargs)
         else:
-            return await self._bot.loop.run_in_executor(self.thread_pool, functools.partial(self.unsafe_ytdl.extract_info, *args, **kwargs))
+            return await self._extract(self.unsafe_ytdl, args, kwargs, cache)
+
+    async def safe_extract_info(self, *args, cache=True, **kwargs):
+        if cache and self._cacheable(args, kwargs):
+            info = await self._cached_info(args, kwargs)
+            if info is not None:
+                return info
+
+        return await self._extract(self.safe_ytdl, args, kwargs, cache)
+
+    async def process_info(self, url, info):
+        '''
+        finish info extracted from url with process=False the way extract_info(download=False)
+        would, for a single video that only picks its formats instead of extracting it again
+        '''
+        if self.extract_process_pool:
+            info = await self._bot.loop.run_in_executor(
+                self.extract_process_pool,
+                process_info_in_worker,
+                dict(self.unsafe_ytdl.params),
+                info
+            )
+        else:
+            info = await self._bot.loop.run_in_executor(
+                self.thread_pool,
+                functools.partial(self.unsafe_ytdl.process_ie_result, info, download=False)
+            )
+        if self.info_cache:
+            await self._bot.loop.run_in_executor(self.thread_pool, self.info_cache.put, url, True, info)
+        return info
+
+    async def search(self, query, count=5, on_error=None):
+        '''
+        the first count results of a youtube search for query, unresolved, from the search cache
+        if the query was searched for recently
+        '''
+        if self.search_cache:
+            results = self.search_cache.get(query, count)
+            if results is not None:
+                return results
+
+        info = await self.extract_info(
+            'ytsearch{}:{}'.format(count, query),
+            download=False,
+            process=False,
+            cache=False,
+            on_error=on_error,
+            retry_on_error=True
+        )
+
+        if not info:
+            raise Exception(
+                "Error extracting info from search string, youtubedl returned no data. "
+                "You may need to restart the bot if this continues to happen."
+            )
 
-    async def safe_extract_info(self, *args, **kwargs):
-        return await self._bot.loop.run_in_executor(self.thread_pool, functools.partial(self.safe_ytdl.extract_info, *args, **kwargs))
+        results = [item for item in await get_playlist_items(info, self) if item]
+        if self.search_cache:
+            self.search_cache.put(query, count, results)
+        return results
 
     async def process_url_to_info(self, song_url, on_search_error = None):
-        while True:
-            try:
+        '''
+        classify song_url with one extraction and resolve it as far as queueing needs, returns
+        (info, url) where info is processed for a single video and unprocessed for a playlist,
+        whose entries are resolved one by one when they are queued
+        '''
+        try:
+            info = await self.extract_info(song_url, download=False, process=False)
+        except Exception as e:
+            if 'unknown url type' in str(e):
+                song_url = song_url.replace(':', '')  # it's probably not actually an extractor
                 info = await self.extract_info(song_url, download=False, process=False)
-                # If there is an exception arise when processing we go on and let extract_info down the line report it
-                # because info might be a playlist and thing that's broke it might be individual entry
-                try:
-                    info_process = await self.extract_info(song_url, download=False)
-                except:
-                    info_process = None
-                    
-                self._bot.log.debug(info)
-                if info_process and info and info_process.get('_type', None) == 'playlist' and 'entries' not in info and not info.get('url', '').startswith('ytsearch'):
-                    use_url = info_process.get('webpage_url', None) or info_process.get('url', None)
-                    if use_url == song_url:
-                        self._bot.log.warning("Determined incorrect entry type, but suggested url is the same.  Help.")
-                        break # If we break here it will break things down the line and give "This is a playlist" exception as a result
-
-                    self._bot.log.debug("Assumed url \"%s\" was a single entry, was actually a playlist" % song_url)
-                    self._bot.log.debug("Using \"%s\" instead" % use_url)
-                    song_url = use_url
-                else:
-                    break
-
-            except Exception as e:
-                if 'unknown url type' in str(e):
-                    song_url = song_url.replace(':', '')  # it's probably not actually an extractor
-                    info = await self.extract_info(song_url, download=False, process=False)
-                else:
-                    raise e
+            else:
+                raise e
 
         if not info:
             raise Exception("That video cannot be played. Try using the stream command.")
@@ -177,30 +435,33 @@ class YtdlDownloader:
         # abstract the search handling away from the user
         # our ytdl options allow us to use search strings as input urls
         if info.get('url', '').startswith('ytsearch'):
-            info = await self.extract_info(
-                song_url,
-                download=False,
-                process=True,    # ASYNC LAMBDAS WHEN
-                on_error=on_search_error,
-                retry_on_error=True
-            )
-
-            if not info:
-                raise Exception(
-                    "Error extracting info from search string, youtubedl returned no data. "
-                    "You may need to restart the bot if this continues to happen."
-                )
+            # the same results !search lists, so that a popular query is searched for once
+            results = await self.search(info['url'].split(':', 1)[1], on_error=on_search_error)
 
-            if not all(info.get('entries', [])):
+            if not results:
                 # empty list, no data
                 self._bot.log.debug("Got empty list, no data")
-                return
+                return (None, song_url)
 
-            # TODO: handle 'webpage_url' being 'ytsearch:...' or extractor type
-            song_url = info['entries'][0]['webpage_url']
+            song_url = result_url(results[0])
             info = await self.extract_info(song_url, download=False, process=False)
+            if not info:
+                raise Exception("That video cannot be played. Try using the stream command.")
 
-        return (info, song_url)
+        # a link to a page of another extractor, followed unprocessed so that a playlist is not resolved as a whole
+        for _ in range(3):
+            if info.get('_type', None) != 'url':
+                break
+            self._bot.log.debug("Following \"{}\" to \"{}\"".format(song_url, info['url']))
+            info = await self.extract_info(info['url'], download=False, process=False, ie_key=info.get('ie_key'))
+            if not info:
+                raise Exception("That video cannot be played. Try using the stream command.")
+            song_url = info.get('webpage_url', None) or song_url
+
+        self._bot.log.debug(info)
+        if 'entries' in info:
+            return (info, song_url)
+        return (await self.process_info(song_url, info), song_url)
 
 class YtdlUrlEntry(Entry):
     def __init__(self, url, title, duration, queuer_id, metadata, extractor, expected_filename=None):
@@ -209,86 +470,200 @@ class YtdlUrlEntry(Entry):
         self._download_folder = self._extractor.download_folder
         self._expected_filename = expected_filename
 
-    async def prepare_cache(self):
-        async with self._aiolocks['preparing_cache_set']:
-            if self._preparing_cache:
-                return
-            self._preparing_cache = True
+    def serialize(self):
+        data = super().serialize()
+        data['expected_filename'] = self._expected_filename
+        return data
 
+    @property
+    def progress(self):
+        '''
+        DownloadProgress of the running download of this entry, None if it is not downloading
+        '''
+        return self._extractor.downloads.get(self._expected_filename)
+
+    def download_eta(self):
+        if self._local_url:
+            return 0
+        return self._extractor.estimate_download(self._expected_filename, self.duration)
+
+    def cache_names(self):
+        '''
+        names in the audio cache this entry plays from or will download to
+        '''
+        names = {os.path.basename(self._expected_filename)}
+        if self._local_url:
+            names.add(os.path.basename(self._local_url))
+        return names
+
+    async def _resolve_cache(self):
         extractor = os.path.basename(self._expected_filename).split('-')[0]
 
         # the generic extractor requires special handling
         if extractor == 'generic':
-            flistdir = [f.rsplit('-', 1)[0] for f in os.listdir(self._download_folder)]
             expected_fname_noex, fname_ex = os.path.basename(self._expected_filename).rsplit('.', 1)
+            # the file this url was stored as last time, any file of the same name otherwise
+            digest = self._extractor.content_store.hash_of(self.source_url)
+            cached_fname = digest and self._extractor.cache_index.find('{}-{}.{}'.format(expected_fname_noex, digest[-8:], fname_ex))
+            if not cached_fname:
+                cached_fname = self._extractor.cache_index.find_prefix(expected_fname_noex)
 
-            if expected_fname_noex in flistdir:
+            if cached_fname:
                 try:
                     rsize = int(await get_header(self._extractor._bot.aiosession, self.source_url, 'CONTENT-LENGTH'))
                 except:
                     rsize = 0
 
-                lfile = os.path.join(
-                    self._download_folder,
-                    os.listdir(self._download_folder)[flistdir.index(expected_fname_noex)]
-                )
+                lfile = os.path.join(self._download_folder, cached_fname)
 
                 # print("Resolved %s to %s" % (self.expected_filename, lfile))
                 lsize = os.path.getsize(lfile)
                 # print("Remote size: %s Local size: %s" % (rsize, lsize))
 
                 if lsize != rsize:
+                    self._extractor.cache_index.record_miss()
                     await self._really_download(hashing=True)
                 else:
                     # print("[Download] Cached:", self.url)
+                    self._extractor.cache_index.record_hit(cached_fname)
                     self._local_url = lfile
 
             else:
                 # print("File not found in cache (%s)" % expected_fname_noex)
+                self._extractor.cache_index.record_miss()
                 await self._really_download(hashing=True)
 
         else:
-            ldir = os.listdir(self._download_folder)
-            flistdir = [f.rsplit('.', 1)[0] for f in ldir]
             expected_fname_base = os.path.basename(self._expected_filename)
             expected_fname_noex = expected_fname_base.rsplit('.', 1)[0]
 
             # idk wtf this is but its probably legacy code
             # or i have youtube to blame for changing shit again
 
-            if expected_fname_base in ldir:
+            cached_fname = self._extractor.cache_index.find_stem(expected_fname_noex)
+
+            if self._extractor.cache_index.find(expected_fname_base):
                 self._local_url = os.path.join(self._download_folder, expected_fname_base)
+                self._extractor.cache_index.record_hit(expected_fname_base)
                 self._extractor._bot.log.info("Download cached: {}".format(self.source_url))
 
-            elif expected_fname_noex in flistdir:
+            elif cached_fname:
                 self._extractor._bot.log.info("Download cached (different extension): {}".format(self.source_url))
-                self._local_url = os.path.join(self._download_folder, ldir[flistdir.index(expected_fname_noex)])
+                self._local_url = os.path.join(self._download_folder, cached_fname)
+                self._extractor.cache_index.record_hit(cached_fname)
                 self._extractor._bot.log.debug("Expected {}, got {}".format(
                     self._expected_filename.rsplit('.', 1)[-1],
                     self._local_url.rsplit('.', 1)[-1]
                 ))
             else:
+                self._extractor.cache_index.record_miss()
                 await self._really_download()
 
-        # TODO: equalization
+        await self._normalize()
 
-        async with self._aiolocks['preparing_cache_set']:
-            async with self._aiolocks['cached_set']:
-                self._preparing_cache = False
-                self._cached = True
+        self._ingest_opus()
 
-    async def _really_download(self, *, hashing=False):
-        self._extractor._bot.log.info("Download started: {}".format(self.source_url))
+    async def _normalize(self):
+        try:
+            key, gain = await self._extractor.loudness.cached_gain(self._local_url)
+        except Exception as e:
+            self._extractor._bot.log.warning("Could not look up loudness of {} ({})".format(self._local_url, e))
+            return
 
-        retry = True
-        while retry:
+        if gain is not None:
+            self._gain = gain
+            return
+
+        # analyzed in the background, the entry plays unnormalized if it comes up before that
+        async def analyze():
             try:
-                result = await self._extractor.extract_info(self.source_url, download=True)
-                break
+                self._gain = await self._extractor.loudness.get_gain(self._local_url, key)
+                self._extractor._bot.log.debug("Analyzed loudness of {}, gain {:.2f}".format(self._local_url, self._gain))
             except Exception as e:
-                raise e
+                self._extractor._bot.log.warning("Could not analyze loudness of {} ({})".format(self._local_url, e))
+
+        asyncio.ensure_future(analyze())
+
+    def _ingest_opus(self):
+        opus_url = self._extractor.opus_path(self._local_url)
+
+        local_url = self._local_url
 
-        self._extractor._bot.log.info("Download complete: {}".format(self.source_url))
+        async def transcode_and_index(volume):
+            ingested = False
+            if not os.path.isfile(opus_url):
+                await transcode_opus(local_url, opus_url, volume=volume)
+                self._extractor._bot.log.debug("Ingested {} as {}".format(local_url, opus_url))
+                ingested = True
+
+            index = None
+            try:
+                index = await self._extractor._bot.loop.run_in_executor(None, load_ogg_index, opus_url)
+            except Exception as e:
+                self._extractor._bot.log.warning("Could not index {} ({}), seeking will go through ffmpeg".format(opus_url, e))
+
+            if ingested:
+                # the opus file and its index count towards the size of the download they were made from
+                self._extractor.cache_index.add(os.path.basename(local_url))
+            return index
+
+        # the first play does not wait for this, it falls back to decoding the downloaded file
+        async def ingest():
+            try:
+                # the gain is baked into the file, so that players at the default volume pass it through
+                gain = await self._extractor.loudness.get_gain(local_url)
+                volume = default_volume * gain
+                # entries of the same file share one transcode instead of racing on its .part file
+                self._opus_index = await self._extractor.coalesce(
+                    ('ingest', opus_url),
+                    functools.partial(transcode_and_index, volume)
+                )
+            except Exception as e:
+                self._extractor._bot.log.warning("Could not ingest {} as opus ({})".format(local_url, e))
+                return
+            self._gain = gain
+            self._opus_volume = volume
+            self._opus_url = opus_url
+
+        asyncio.ensure_future(ingest())
+
+    async def _really_download(self, *, hashing=False):
+        # entries of the same file wait for one download instead of racing on the same output
+        self._local_url = await self._extractor.coalesce(
+            ('download', self._expected_filename),
+            functools.partial(self._download, hashing=hashing)
+        )
+
+    async def _download(self, *, hashing=False):
+        self._extractor._bot.log.info("Download started: {}".format(self.source_url))
+
+        extractor = os.path.basename(self._expected_filename).split('-')[0]
+        # youtube_dl skips files that exist already, those say nothing about throughput
+        existed = os.path.isfile(self._expected_filename)
+        progress = self._extractor.downloads[self._expected_filename] = DownloadProgress(self.title, extractor)
+
+        retry = True
+        try:
+            while retry:
+                try:
+                    result = await self._extractor.extract_info(self.source_url, download=True)
+                    break
+                except Exception as e:
+                    raise e
+        finally:
+            self._extractor.downloads.pop(self._expected_filename, None)
+
+        if result and not existed and os.path.isfile(self._expected_filename):
+            size = os.path.getsize(self._expected_filename)
+            self._extractor.throughput.record(extractor, size, self.duration, progress.elapsed)
+            self._extractor._bot.log.info("Download complete: {} ({} bytes in {:.1f}s, {:.0f}KiB/s)".format(
+                self.source_url,
+                size,
+                progress.elapsed,
+                size / 1024 / max(progress.elapsed, 0.001)
+            ))
+        else:
+            self._extractor._bot.log.info("Download complete: {}".format(self.source_url))
 
         if result is None:
             self._extractor._bot.log.critical("YTDL has failed, everyone panic")
@@ -296,14 +671,15 @@ class YtdlUrlEntry(Entry):
             # What the fuck do I do now?
 
         self._local_url = unhashed_fname = self._extractor.ytdl.prepare_filename(result)
-
-
-        # TODO: check storage limit
-
+        digest = result.get('content_md5')
 
         if hashing:
             # insert the 8 last characters of the file hash to the file name to ensure uniqueness
-            self._local_url = md5sum(unhashed_fname, 8).join('-.').join(unhashed_fname.rsplit('.', 1))
+            if digest:
+                suffix = digest[-8:]
+            else:
+                suffix = await self._extractor._bot.loop.run_in_executor(self._extractor.thread_pool, md5sum, unhashed_fname, 8)
+            self._local_url = suffix.join('-.').join(unhashed_fname.rsplit('.', 1))
 
             if os.path.isfile(self._local_url):
                 # Oh bother it was actually there.
@@ -312,33 +688,42 @@ class YtdlUrlEntry(Entry):
                 # Move the temporary file to it's final location.
                 os.rename(unhashed_fname, self._local_url)
 
+        if os.path.isfile(self._local_url):
+            if digest:
+                self._extractor.content_store.store(self.source_url, self._local_url, digest)
+            self._extractor.cache_index.add(os.path.basename(self._local_url))
+            await self._extractor.trim_cache(os.path.basename(self._local_url))
+
+        return self._local_url
+
 class YtdlStreamEntry(Entry):
+    is_live = True
+
     def __init__(self, source_url, title, queuer_id, metadata, extractor, destination = None):
         self._extractor = extractor
         super().__init__(source_url, title, 0, queuer_id, metadata)
         self._destination = destination
 
-    async def prepare_cache(self):
-        async with self._aiolocks['preparing_cache_set']:
-            if self._preparing_cache:
-                return
-            self._preparing_cache = True
+    def serialize(self):
+        data = super().serialize()
+        data['destination'] = self._destination
+        return data
 
+    async def _resolve_cache(self):
         await self._really_download()
 
-        async with self._aiolocks['preparing_cache_set']:
-            async with self._aiolocks['cached_set']:
-                self._preparing_cache = False
-                self._cached = True
+    async def refresh(self):
+        # the cached stream url is the one that stopped working
+        await self._really_download(cache=False)
 
-    async def _really_download(self, *, fallback=False):
+    async def _really_download(self, *, fallback=False, cache=True):
         url = self._destination if fallback else self.source_url
 
         try:
-            result = await self._extractor.extract_info(url, download=False)
+            result = await self._extractor.extract_info(url, download=False, cache=cache)
         except Exception as e:
             if not fallback and self._destination:
-                return await self._really_download(fallback=True)
+                return await self._really_download(fallback=True, cache=cache)
 
             raise e
         else:
@@ -347,17 +732,49 @@ class YtdlStreamEntry(Entry):
             # for when ffmpeg inevitebly fucks up and i have to restart
             # although maybe that should be at a slightly lower level
 
+def entry_from_serialized(data, extractor, metadata):
+    '''
+    recreate an entry from Entry.serialize without extracting its info again,
+    returns None for entry types that cannot be recreated
+    '''
+    if data['type'] == 'YtdlUrlEntry':
+        entry = YtdlUrlEntry(
+            data['source_url'],
+            data['title'],
+            data['duration'],
+            data['queuer_id'],
+            metadata,
+            extractor,
+            data['expected_filename']
+        )
+    elif data['type'] == 'YtdlStreamEntry':
+        entry = YtdlStreamEntry(
+            data['source_url'],
+            data['title'],
+            data['queuer_id'],
+            metadata,
+            extractor,
+            destination = data['destination']
+        )
+    else:
+        return None
+
+    entry._resume_offset = data.get('resume_offset', 0)
+    return entry
+
 class WrongEntryTypeError(Exception):
     def __init__(self, message, is_playlist, use_url):
         super().__init__(message)
         self.is_playlist = is_playlist
         self.use_url = use_url
 
-async def get_entry(song_url, queuer_id, extractor, metadata):
-    try:
-        info = await extractor.extract_info(song_url, download=False)
-    except Exception as e:
-        raise Exception('Could not extract information from {}\n\n{}'.format(song_url, e))
+async def get_entry(song_url, queuer_id, extractor, metadata, info=None):
+    # info is passed when the url has been resolved by process_url_to_info already
+    if not info:
+        try:
+            info = await extractor.extract_info(song_url, download=False)
+        except Exception as e:
+            raise Exception('Could not extract information from {}\n\n{}'.format(song_url, e))
 
     if not info:
         raise Exception('Could not extract information from %s' % song_url)
@@ -455,45 +872,112 @@ async def get_stream_entry(song_url, queuer_id, extractor, metadata):
 
     return entry
 
-async def get_entry_list_from_playlist_url(playlist_url, queuer_id, extractor, metadata):
-    entry_list = []
-
-    try:
-        info = await extractor.safe_extract_info(playlist_url, download=False)
-    except Exception as e:
-        raise Exception('Could not extract information from {}\n\n{}'.format(playlist_url, e))
-
-    if not info:
-        raise Exception('Could not extract information from %s' % playlist_url)
-
+def result_url(item):
+    '''
+    url of an unresolved search result or playlist item
+    '''
+    url = item.get('webpage_url', None) or item['url']
+    if item.get('ie_key') == 'Youtube' and not url.startswith(('http://', 'https://')):
+        return 'https://www.youtube.com/watch?v={}'.format(url)
+    return url
+
+async def get_playlist_items(info, extractor):
+    '''
+    unresolved entries of a playlist extracted with process=False, listing a lazily paged
+    playlist only fetches its pages, not the videos in it
+    '''
+    entries = info.get('entries') or []
+    if isinstance(entries, list):
+        return entries
+    return await extractor._bot.loop.run_in_executor(extractor.thread_pool, list, entries)
+
+def playlist_length(info):
+    '''
+    number of items in a playlist extracted with process=False, None if that is not known
+    without listing all of its pages
+    '''
+    entries = info.get('entries')
+    if isinstance(entries, list):
+        return len(entries)
+    return info.get('playlist_count') or info.get('n_entries')
+
+async def iter_entries_from_playlist(info, queuer_id, extractor, metadata, ahead=4):
+    '''
+    resolve the items of a playlist extracted with process=False into entries, yielded in
+    playlist order as soon as each is ready with up to ahead items resolved at once. pages
+    of a lazily paged playlist are fetched as the items are reached. yields None for items
+    that cannot be played
+    '''
     # Once again, the generic extractor fucks things up.
     if info.get('extractor', None) == 'generic':
         url_field = 'url'
     else:
         url_field = 'webpage_url'
 
+    async def resolve(item):
+        if not item:
+            return None
+        if item.get('_type', 'video') in ('url', 'url_transparent'):
+            return await extractor.safe_extract_info(item['url'], download=False, ie_key=item.get('ie_key'))
+        return await extractor._bot.loop.run_in_executor(
+            extractor.thread_pool,
+            functools.partial(extractor.ytdl.process_ie_result, item, download=False)
+        )
+
+    end = object()
+    items = iter(info.get('entries') or [])
+    def next_item():
+        # the next page of the playlist is fetched here once the current one runs out
+        return next(items, end)
+
     baditems = 0
-    for item in info['entries']:
-        if item:
+    pending = deque()
+    fetch = None
+    exhausted = False
+    try:
+        while True:
+            if not exhausted and not fetch and len(pending) < ahead:
+                fetch = extractor._bot.loop.run_in_executor(extractor.thread_pool, next_item)
+            if not fetch and not pending:
+                break
+
+            # entries that are ready go out while the next page is still being fetched
+            await asyncio.wait([f for f in (fetch, pending[0] if pending else None) if f], return_when=asyncio.FIRST_COMPLETED)
+            if fetch and fetch.done():
+                item, fetch = fetch.result(), None
+                if item is end:
+                    exhausted = True
+                else:
+                    pending.append(asyncio.ensure_future(resolve(item)))
+            if not pending or not pending[0].done():
+                continue
+
+            entry = None
+            item = None
             try:
-                entry = YtdlUrlEntry(
-                    item[url_field],
-                    item.get('title', 'Untitled'),
-                    item.get('duration', 0) or 0,
-                    queuer_id,
-                    metadata,
-                    extractor,
-                    extractor.ytdl.prepare_filename(info)
-                )
-                entry_list.append(entry)
+                item = await pending.popleft()
+                if item:
+                    entry = YtdlUrlEntry(
+                        item[url_field],
+                        item.get('title', 'Untitled'),
+                        item.get('duration', 0) or 0,
+                        queuer_id,
+                        metadata,
+                        extractor,
+                        extractor.ytdl.prepare_filename(item)
+                    )
             except Exception as e:
-                baditems += 1
                 extractor._bot.log.warning("Could not add item", exc_info=e)
                 extractor._bot.log.debug("Item: {}".format(item), exc_info=True)
-        else:
-            baditems += 1
-
-    if baditems:
-        extractor._bot.log.info("Skipped {} bad entries".format(baditems))
 
-    return entry_list
\ No newline at end of file
+            if not entry:
+                baditems += 1
+            yield entry
+    finally:
+        for task in pending:
+            task.cancel()
+        if fetch:
+            fetch.cancel()
+
+        if baditems:
+            extractor._bot.log.info("Skipped {} bad entries".format(baditems))
\ No newline at end of file
@@ -24,20 +24,34 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 
-from asyncio import Lock, create_task, CancelledError, run_coroutine_threadsafe, sleep, Future
+from asyncio import Lock, Condition, Queue, create_task, create_subprocess_exec, get_event_loop, CancelledError, run_coroutine_threadsafe, sleep, shield
 from enum import Enum
-from collections import defaultdict, deque
+from collections import defaultdict, deque, Counter
 from typing import Union, Optional
-from discord import FFmpegPCMAudio, PCMVolumeTransformer, AudioSource
+from discord import FFmpegPCMAudio, FFmpegOpusAudio, PCMVolumeTransformer, AudioSource
+from discord.oggparse import OggStream
 from functools import partial
-from .utils import callback_dummy_future
-from itertools import islice
+from .utils import fixg
+from .structures import IndexedQueue
+from .scheduler import CachePriority
+from .journal import PlaylistJournal
+from .fanout import shared_sources
+from .segments import hot_tracks
 from datetime import timedelta
 import traceback
 import subprocess
+import os
+import threading
 from random import shuffle
+from bisect import bisect_left, bisect_right
+import json
+from time import perf_counter
+from math import isclose
 
 class Entry:
+    # streams have no end and expire, an unknown duration does not make an entry one
+    is_live = False
+
     def __init__(self, source_url, title, duration, queuer_id, metadata):
         self.source_url = source_url
         self.title = title
@@ -49,6 +63,11 @@ class Entry:
         self._cache_task = None # playlists set this
         self._metadata = metadata
         self._local_url = None
+        self._opus_url = None # set once the entry has been ingested as ogg/opus
+        self._opus_index = None
+        self._opus_volume = 1.0 # volume baked into the ogg/opus file
+        self._resume_offset = 0
+        self._gain = 1.0 # loudness normalization, multiplied into the player volume
 
     async def is_preparing_cache(self):
         async with self._aiolocks['preparing_cache_set']:
@@ -64,34 +83,196 @@ class Entry:
                 return
             self._preparing_cache = True
 
-        async with self._aiolocks['preparing_cache_set']:
-            async with self._aiolocks['cached_set']:
-                self._preparing_cache = False
-                self._cached = True
+        cached = False
+        try:
+            await self._resolve_cache()
+            cached = True
+        finally:
+            # a failed or cancelled attempt must not keep the next one from running
+            async with self._aiolocks['preparing_cache_set']:
+                async with self._aiolocks['cached_set']:
+                    self._preparing_cache = False
+                    if cached:
+                        self._cached = True
+
+    async def _resolve_cache(self):
+        '''
+        make the entry playable, subclasses download or resolve their url here
+        '''
+        pass
 
     def get_metadata(self):
         return self._metadata
 
+    def serialize(self):
+        '''
+        json serializable state needed to recreate the entry without extracting it again
+        '''
+        channel = (self._metadata or dict()).get('channel')
+        return {
+            'type': type(self).__name__,
+            'source_url': self.source_url,
+            'title': self.title,
+            'duration': self.duration,
+            'queuer_id': self.queuer_id,
+            'channel_id': channel.id if channel else None,
+            'resume_offset': self._resume_offset
+        }
+
     def get_duration(self):
         return timedelta(seconds=self.duration)
 
     async def set_local_url(self, local_url):
         self._local_url = local_url
 
+    async def refresh(self):
+        '''
+        resolve local_url again, for entries whose url expires
+        '''
+        pass
+
+    def download_eta(self):
+        '''
+        seconds until the entry has been downloaded, 0 if it is ready or there is no telling
+        '''
+        return 0
+
+async def transcode_opus(source, destination, *, bitrate = 128, volume = 1.0):
+    '''
+    transcode source into a 48kHz stereo ogg/opus file with 20ms frames at destination,
+    which can then be sent to discord without decoding. volume is applied before encoding,
+    so that players at that volume can pass the file through as is
+    '''
+    temp = '{}.part'.format(destination)
+    process = await create_subprocess_exec(
+        'ffmpeg', '-nostdin', '-y', '-loglevel', 'error',
+        '-i', source,
+        '-vn', '-map', '0:a:0', '-filter:a', 'volume={}'.format(volume),
+        '-c:a', 'libopus', '-b:a', '{}k'.format(bitrate), '-ar', '48000', '-ac', '2', '-frame_duration', '20',
+        '-f', 'ogg', temp,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    if process.returncode:
+        if os.path.isfile(temp):
+            os.unlink(temp)
+        raise Exception('ffmpeg failed to transcode {}: {}'.format(source, stderr.decode(errors='replace').strip()))
+    os.replace(temp, destination)
+
+def build_ogg_index(path):
+    '''
+    list of [start time in seconds, byte offset] of every ogg page in path that starts
+    with a fresh opus packet, reading only page headers
+    '''
+    index = list()
+    pre_skip = 0
+    last_granule = None
+    with open(path, 'rb') as fp:
+        offset = 0
+        while True:
+            header = fp.read(27)
+            if len(header) < 27:
+                break
+            if header[:4] != b'OggS':
+                raise Exception('{} is not an ogg file'.format(path))
+            continued = header[5] & 1
+            granule = int.from_bytes(header[6:14], 'little', signed=True)
+            segments = fp.read(header[26])
+            body_size = sum(segments)
+            if last_granule is None:
+                # identification header, pre-skip is counted in every granule position
+                body = fp.read(body_size)
+                if body.startswith(b'OpusHead'):
+                    pre_skip = int.from_bytes(body[10:12], 'little')
+                last_granule = 0
+            elif granule > 0:
+                if not continued and last_granule:
+                    index.append([max(0, last_granule - pre_skip) / 48000, offset])
+                elif not index:
+                    index.append([0, offset])
+                last_granule = granule
+            offset += 27 + len(segments) + body_size
+            fp.seek(offset)
+    return index
+
+def load_ogg_index(path):
+    '''
+    page index of path, read from the sidecar next to it or built and saved there
+    '''
+    index_path = '{}.idx'.format(path)
+    if os.path.isfile(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        with open(index_path, 'r') as fp:
+            return json.load(fp)
+
+    index = build_ogg_index(path)
+    with open('{}.part'.format(index_path), 'w') as fp:
+        fp.write(json.dumps(index))
+    os.replace('{}.part'.format(index_path), index_path)
+    return index
+
 class Playlist:
-    def __init__(self, name, bot, *, precache = 1, persistent = False):
+    def __init__(self, name, bot, *, precache = 1, persistent = False, scheduler = None, loader = None):
         self._bot = bot
         self._name = name
         self._aiolocks = defaultdict(Lock)
-        self._list = deque()
+        self._list = IndexedQueue(weight = lambda entry: entry.duration)
+        self._entry_available = Condition(self._aiolocks['list'])
+        self._queuer_count = Counter()
         self._precache = precache
+        self._scheduler = scheduler
+        self._journal = None
+        if persistent:
+            self._journal = PlaylistJournal(os.path.join('data', 'playlists', name))
+            self._restore(loader)
+
+    def _restore(self, loader):
+        serialized, ops = self._journal.load()
+        entries = [loader(data) if loader else None for data in serialized]
+        for op in ops:
+            if op['op'] == 'add':
+                entry = loader(op['entry']) if loader else None
+                if op['head']:
+                    entries.insert(0, entry)
+                else:
+                    entries.append(entry)
+            elif op['op'] == 'remove':
+                entries.pop(op['position'])
+            elif op['op'] == 'pop':
+                entries.pop(0)
+
+        # entries that could not be loaded are only kept until the journal has been replayed
+        self._list.rebuild(entry for entry in entries if entry)
+        for entry in self._list:
+            self._count_queuer(entry, 1)
+        if ops or len(self._list) != len(serialized):
+            self._compact()
+        if self._bot:
+            self._bot.log.info('restored {} entries into playlist {}'.format(len(self._list), self._name))
+
+        for slot in range(self._precache):
+            self._precache_slot(slot)
+
+    def _log(self, op):
+        if self._journal:
+            self._journal.append(op)
+            if self._journal.should_compact():
+                self._compact()
+
+    def _compact(self):
+        if self._journal:
+            self._journal.snapshot([entry.serialize() for entry in self._list])
 
     async def __getitem__(self, item: Union[int, slice]):
         async with self._aiolocks['list']:
             if isinstance(item, slice):
-                return [await entry.get_metadata() for entry in self._list[item]]
+                return [entry.get_metadata() for entry in self._list[item]]
             else:
-                return await self._list[item].get_metadata()
+                return self._list[item].get_metadata()
+
+    async def get_entry_at(self, item: Union[int, slice]):
+        async with self._aiolocks['list']:
+            return self._list[item]
 
     async def stop(self):
         async with self._aiolocks['list']:
@@ -105,28 +286,80 @@ class Playlist:
                     entry._cache_task = None
                     entry._preparing_cache = False
                     entry._cached = False
+            if self._journal:
+                self._compact()
+                self._journal.close()
 
     async def shuffle(self):
         async with self._aiolocks['list']:
-            shuffle(self._list)
-            for entry in self._list[:self._precache]:
-                if not entry._cache_task:
-                    entry._cache_task = create_task(entry.prepare_cache())
+            entries = list(self._list)
+            shuffle(entries)
+            self._list.rebuild(entries)
+            self._compact()
+            for slot, entry in enumerate(self._list[:self._precache]):
+                if self._needs_cache(entry):
+                    entry._cache_task = self._schedule_cache(entry, CachePriority.PRECACHE + slot)
 
     def get_name(self):
         return self._name
 
+    def _schedule_cache(self, entry, priority):
+        if self._scheduler:
+            return self._scheduler.schedule(entry, priority, self._name)
+        return create_task(entry.prepare_cache())
+
+    @staticmethod
+    def _needs_cache(entry):
+        # a cancelled download is done but left the entry unplayable
+        return not entry._cache_task or entry._cache_task.cancelled()
+
+    def _count_queuer(self, entry, delta):
+        self._queuer_count[entry.queuer_id] += delta
+        if not self._queuer_count[entry.queuer_id]:
+            del self._queuer_count[entry.queuer_id]
+
     async def _get_entry(self):
         async with self._aiolocks['list']:
             if not self._list:
                 return
 
             entry = self._list.popleft()
-            if not entry._cache_task:
-                entry._cache_task = create_task(entry.prepare_cache())
+            self._count_queuer(entry, -1)
+            self._log({'op': 'pop'})
+            self._cache_for_playing(entry)
+            self._precache_slot(self._precache - 1)
 
         return (entry, entry._cache_task)
 
+    def _cache_for_playing(self, entry):
+        if self._needs_cache(entry) or (self._scheduler and not entry._cache_task.done()):
+            # raises the priority if entry is already waiting in the scheduler
+            entry._cache_task = self._schedule_cache(entry, CachePriority.PLAYING)
+
+    async def _peek_entry(self):
+        '''
+        (entry, cache task) of the head without taking it out, its download gets playing priority
+        '''
+        async with self._aiolocks['list']:
+            if not self._list:
+                return
+            entry = self._list[0]
+            self._cache_for_playing(entry)
+            return (entry, entry._cache_task)
+
+    async def _take_entry(self, entry):
+        '''
+        pop entry if it is still the head, false if it was removed or moved in the meantime
+        '''
+        async with self._aiolocks['list']:
+            if not self._list or self._list[0] is not entry:
+                return False
+            self._list.popleft()
+            self._count_queuer(entry, -1)
+            self._log({'op': 'pop'})
+            self._precache_slot(self._precache - 1)
+            return True
+
     async def add_entry(self, entry, *, head = False):
         async with self._aiolocks['list']:
             if head:
@@ -135,25 +368,39 @@ class Playlist:
             else:
                 self._list.append(entry)
                 position = len(self._list) - 1
-            if self._precache > position:
-                entry._cache_task = create_task(entry.prepare_cache())
+            self._count_queuer(entry, 1)
+            self._log({'op': 'add', 'head': head, 'entry': entry.serialize()})
+            self._precache_slot(position)
+            self._entry_available.notify_all()
             return position + 1
 
+    async def wait_for_entry(self):
+        '''
+        block until there is at least one entry in the playlist
+        '''
+        async with self._entry_available:
+            await self._entry_available.wait_for(lambda: self._list)
+
+    def _precache_slot(self, slot):
+        if 0 <= slot < min(self._precache, len(self._list)):
+            entry = self._list[slot]
+            if self._needs_cache(entry):
+                entry._cache_task = self._schedule_cache(entry, CachePriority.PRECACHE + slot)
+
     async def get_length(self):
         async with self._aiolocks['list']:
             return len(self._list)
 
     async def remove_position(self, position):
         async with self._aiolocks['list']:
+            val = self._list.pop(position)
+            self._count_queuer(val, -1)
+            self._log({'op': 'remove', 'position': position})
+            if val._cache_task:
+                val._cache_task.cancel()
+                val._cache_task = None
             if position < self._precache:
-                self._list[position]._cache_task.cancel()
-                self._list[position]._cache_task = None
-                if self._precache <= len(self._list):
-                    consider = self._list[self._precache - 1]
-                    if not consider.cache_task:
-                        consider.cache_task = create_task(consider.prepare_cache())
-            val = self._list[position]
-            del self._list[position]
+                self._precache_slot(self._precache - 1)
             return val
 
     async def get_entry_position(self, entry):
@@ -162,22 +409,21 @@ class Playlist:
 
     async def estimate_time_until(self, position):
         async with self._aiolocks['list']:
-            estimated_time = sum(e.duration for e in islice(self._list, position - 1))
+            estimated_time = self._list.weight_until(position - 1)
         return timedelta(seconds=estimated_time)
 
     async def estimate_time_until_entry(self, entry):
-        estimated_time = 0
         async with self._aiolocks['list']:
-            for e in self._list:
-                if e is not entry:  
-                    estimated_time += e.duration
-                else:
-                    break
-        return timedelta(seconds=estimated_time)            
+            estimated_time = self._list.weight_until_item(entry)
+        return timedelta(seconds=estimated_time)
 
     async def num_entry_of(self, user_id):
         async with self._aiolocks['list']:
-            return sum(1 for e in self._list if e.queuer_id == user_id)
+            return self._queuer_count[user_id]
+
+    async def get_entries(self):
+        async with self._aiolocks['list']:
+            return list(self._list)
 
 class PlayerState(Enum):
     PLAYING = 0
@@ -186,34 +432,449 @@ class PlayerState(Enum):
     WAITING = 3
 
 
+class PlaybackStats:
+    '''
+    frame timing of a guild's playback, kept as fixed bucket histograms so that recording
+    from the voice thread is only a few integer increments
+
+    a frame is late when reading it took longer than the 20ms it lasts, short when a pcm
+    frame came back with less than 20ms of audio, and an underrun is a source that ran dry
+    before the end of its entry. a stall is a frame of silence sent while a stream was
+    waiting on the network and reconnects count how often a stream had to be reopened
+
+    command latency is how long a player command waited in the queue plus how long it took
+    to handle, so that spamming commands shows up as queueing delay
+    '''
+    frame_budget = 0.02
+    pcm_frame_size = 3840
+    latency_buckets = (0.001, 0.002, 0.005, 0.01, 0.02, 0.04, 0.08)
+    startup_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+    command_buckets = (0.001, 0.005, 0.02, 0.1, 0.5, 2)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.late = 0
+        self.short = 0
+        self.underruns = 0
+        self.stalls = 0
+        self.reconnects = 0
+        self.latency_max = 0
+        self.latency = [0] * (len(self.latency_buckets) + 1)
+        self.startup = [0] * (len(self.startup_buckets) + 1)
+        self.startup_last = None
+        self.commands = 0
+        self.command_max = 0
+        self.command = [0] * (len(self.command_buckets) + 1)
+
+    def record_frame(self, latency, size, opus):
+        self.frames += 1
+        self.latency[bisect_left(self.latency_buckets, latency)] += 1
+        if latency > self.latency_max:
+            self.latency_max = latency
+        if latency > self.frame_budget:
+            self.late += 1
+        if not opus and size < self.pcm_frame_size:
+            self.short += 1
+
+    def record_underrun(self):
+        self.underruns += 1
+
+    def record_stall(self):
+        self.stalls += 1
+
+    def record_reconnect(self):
+        self.reconnects += 1
+
+    def record_startup(self, seconds):
+        self.startup[bisect_left(self.startup_buckets, seconds)] += 1
+        self.startup_last = seconds
+
+    def record_command(self, seconds):
+        self.commands += 1
+        self.command[bisect_left(self.command_buckets, seconds)] += 1
+        if seconds > self.command_max:
+            self.command_max = seconds
+
+    def snapshot(self):
+        def labeled(buckets, counts):
+            labels = ['<={}ms'.format(fixg(bound * 1000)) for bound in buckets]
+            labels.append('>{}ms'.format(fixg(buckets[-1] * 1000)))
+            return dict(zip(labels, counts))
+
+        return {
+            'frames': self.frames,
+            'late': self.late,
+            'short': self.short,
+            'underruns': self.underruns,
+            'stalls': self.stalls,
+            'reconnects': self.reconnects,
+            'latency_max': self.latency_max,
+            'latency': labeled(self.latency_buckets, self.latency),
+            'startup_last': self.startup_last,
+            'startup': labeled(self.startup_buckets, self.startup),
+            'commands': self.commands,
+            'command_max': self.command_max,
+            'command': labeled(self.command_buckets, self.command)
+        }
+
 class SourcePlaybackCounter(AudioSource):
-    def __init__(self, source, progress = 0):
+    def __init__(self, source, progress = 0, *, entry = None, stats = None, expected = 0, started = None):
         self._source = source
+        self.entry = entry
         self.progress = progress
+        self._stats = stats
+        self._expected = expected
+        self._started = started
 
     def read(self):
+        if not self._stats:
+            res = self._source.read()
+            if res:
+                self.progress += 1
+            return res
+
+        start = perf_counter()
         res = self._source.read()
+        end = perf_counter()
         if res:
             self.progress += 1
+            self._stats.record_frame(end - start, len(res), self._source.is_opus())
+            if self._started:
+                self._stats.record_startup(end - self._started)
+                self._started = None
+        elif self._expected and self.get_progress() < self._expected - 1:
+            self._stats.record_underrun()
+            self._expected = 0
         return res
 
+    def is_opus(self):
+        return self._source.is_opus()
+
+    def cleanup(self):
+        self._source.cleanup()
+
     def get_progress(self):
         return self.progress * 0.02
 
+class PrefetchedSource(AudioSource):
+    '''
+    source with its first frames already read, so that it starts without waiting for ffmpeg
+    '''
+    def __init__(self, source, frames, startup = None):
+        self._source = source
+        self._frames = deque(frames)
+        self.startup = startup
+
+    @classmethod
+    async def prefetch(cls, source, frames = 25):
+        started = perf_counter()
+        def read_frames():
+            read = [source.read()]
+            startup = perf_counter() - started
+            read.extend(source.read() for _ in range(frames - 1))
+            return read, startup
+        return cls(source, *await get_event_loop().run_in_executor(None, read_frames))
+
+    def read(self):
+        if self._frames:
+            return self._frames.popleft()
+        return self._source.read()
+
+    def is_opus(self):
+        return self._source.is_opus()
+
+    def cleanup(self):
+        self._source.cleanup()
+
+class GaplessSource(AudioSource):
+    '''
+    plays a source and switches to the one given to set_next on the frame the current one
+    runs out, so the voice client never stops in between. on_swap is called with the new
+    source from the voice thread
+    '''
+    def __init__(self, source, on_swap):
+        self._current = source
+        self._next = None
+        self._skip = False
+        self._on_swap = on_swap
+        self._lock = threading.Lock()
+
+    def set_next(self, source):
+        with self._lock:
+            self._next = source
+
+    @property
+    def source(self):
+        return self._current
+
+    @property
+    def next(self):
+        with self._lock:
+            return self._next
+
+    def take_next(self):
+        with self._lock:
+            source, self._next = self._next, None
+            return source
+
+    def skip(self):
+        '''
+        swap to the next source on the next frame, returns False if there is none
+        '''
+        with self._lock:
+            if self._next:
+                self._skip = True
+            return self._skip
+
+    def read(self):
+        data = b'' if self._skip else self._current.read()
+        if not data:
+            with self._lock:
+                source, self._next, self._skip = self._next, None, False
+            if source:
+                self._current.cleanup()
+                self._current = source
+                self._on_swap(source)
+                data = source.read()
+        return data
+
+    def is_opus(self):
+        return self._current.is_opus()
+
+    def cleanup(self):
+        self._current.cleanup()
+        source = self.take_next()
+        if source:
+            source.cleanup()
+
+class BufferedStreamSource(AudioSource):
+    '''
+    reads a network stream ahead into a buffer of at most `buffer` frames on a thread of its
+    own and opens it again when ffmpeg gives up, so that a stall is heard as silence instead
+    of ending the entry. create(offset) opens the stream, which is reopened where it is now
+    since a live stream cannot be rewound. refresh resolves the url again, it is called from
+    the reading thread once reopening with the old url keeps failing
+    '''
+    silence = b'\x00' * 3840
+
+    def __init__(self, create, offset = 0, *, refresh = None, stats = None, buffer = 250, retries = 5):
+        self._create = create
+        self._refresh = refresh
+        self._stats = stats
+        self._buffer = buffer
+        self._retries = retries
+        self._frames = deque()
+        self._condition = threading.Condition()
+        self._started = False
+        self._closed = False
+        self._done = False
+        self._stream = create(offset)
+        threading.Thread(target = self._read_ahead, daemon = True).start()
+
+    def _read_ahead(self):
+        failures = 0
+        refreshed = False
+        while True:
+            stream = self._stream
+            data = stream.read() if stream else b''
+            if data:
+                failures = 0
+                with self._condition:
+                    while len(self._frames) >= self._buffer and not self._closed:
+                        self._condition.wait()
+                    if self._closed:
+                        break
+                    self._frames.append(data)
+                    self._condition.notify_all()
+                continue
+
+            with self._condition:
+                if self._closed:
+                    break
+                self._stream = None
+            if stream:
+                stream.cleanup()
+
+            failures += 1
+            if failures > self._retries:
+                break
+            with self._condition:
+                self._condition.wait_for(lambda: self._closed, min(0.5 * 2 ** (failures - 1), 5))
+                if self._closed:
+                    break
+
+            if failures > 2 and self._refresh and not refreshed:
+                refreshed = True
+                try:
+                    self._refresh()
+                except Exception:
+                    pass
+            try:
+                stream = self._create(0)
+            except Exception:
+                stream = None
+            with self._condition:
+                if self._closed:
+                    if stream:
+                        stream.cleanup()
+                    break
+                self._stream = stream
+            if self._stats:
+                self._stats.record_reconnect()
+
+        with self._condition:
+            self._done = True
+            self._condition.notify_all()
+
+    def read(self):
+        with self._condition:
+            if not self._started:
+                # the first frame is waited for, so that playback does not start with silence
+                self._condition.wait_for(lambda: self._frames or self._done or self._closed)
+                self._started = True
+            elif not self._frames and not self._done:
+                self._condition.wait(0.02)
+
+            if self._frames:
+                data = self._frames.popleft()
+                self._condition.notify_all()
+                return data
+            if self._done or self._closed:
+                return b''
+
+        if self._stats:
+            self._stats.record_stall()
+        return self.silence
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        with self._condition:
+            self._closed = True
+            stream, self._stream = self._stream, None
+            self._condition.notify_all()
+        # also unblocks the reading thread if it is waiting on ffmpeg
+        if stream:
+            stream.cleanup()
+
+class OggOpusSource(AudioSource):
+    '''
+    sends opus packets straight from an ogg/opus file, starting offset seconds in by way
+    of its page index, without spawning ffmpeg or decoding anything
+    '''
+    def __init__(self, path, index = None, offset = 0):
+        self._file = open(path, 'rb')
+        start = 0
+        if offset and index:
+            page = max(0, bisect_right(index, [offset, float('inf')]) - 1)
+            start, position = index[page]
+            self._file.seek(position)
+        self._packets = OggStream(self._file).iter_packets()
+        for _ in range(int((offset - start) / 0.02)):
+            next(self._packets, None)
+
+    def read(self):
+        packet = next(self._packets, b'')
+        while packet.startswith((b'OpusHead', b'OpusTags')):
+            packet = next(self._packets, b'')
+        return packet
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self._file.close()
+
+def _volume_transformer(source):
+    while source is not None and not isinstance(source, PCMVolumeTransformer):
+        source = getattr(source, '_source', None)
+    return source
+
+# volume new players start at, ingested opus files are encoded at it
+default_volume = 0.15
+
 class Player:
-    def __init__(self, guild, volume = 0.15):
-        self._aiolocks = defaultdict(Lock)
+    '''
+    a guild's player is driven by a single task that takes commands off a queue one by one,
+    so every state transition happens in order without locks. long running work (waiting for
+    entries, caching and prefetching) is done in helper tasks that post their result back as
+    a command tagged with a token, results of work that was cancelled in the mean time are
+    recognized by a stale token and undone instead of applied
+
+    status, progress and the current entry are only read, so they do not go through the queue
+    '''
+    def __init__(self, guild, volume = default_volume, *, passthrough = True, lookahead = 10, fanout = shared_sources, segments = hot_tracks):
+        self._commands = Queue()
         self._current = None
         self._playlist = None
         self._guild = guild
         self._player = None
-        self._play_task = None
-        self._play_safe_task = None
         self._source = None
+        self._gapless = None
+        self._next_entry = None
+        self._fetch_task = None
+        self._fetch_token = 0
+        self._lookahead_task = None
+        self._lookahead_token = 0
+        self._pause_pending = False
         self._volume = volume
+        self._passthrough = passthrough
+        self._lookahead = lookahead
+        self._fanout = fanout
+        self._segments = segments
+        self._stats = PlaybackStats()
+        self._killed = False
         self.state = PlayerState.PAUSE
 
-        create_task(self.play())
+        self._actor = create_task(self._run())
+        self._post('play', None, None, None)
+
+    def _post(self, command, *args, reply = False):
+        future = get_event_loop().create_future() if reply else None
+        self._commands.put_nowait((command, args, future, perf_counter()))
+        return future
+
+    def _post_threadsafe(self, command, *args):
+        def post(*extra):
+            self._guild._bot.loop.call_soon_threadsafe(partial(self._post, command, *args, *extra))
+        return post
+
+    async def _call(self, command, *args):
+        if self._killed:
+            raise Exception('player has been killed!')
+        return await self._post(command, *args, reply = True)
+
+    async def _run(self):
+        while True:
+            command, args, future, queued = await self._commands.get()
+            await self._handle(command, args, future, queued)
+            if command == 'kill':
+                break
+
+        # finish whatever is left so that entries handed over by helper tasks are not lost
+        while not self._commands.empty():
+            command, args, future, queued = self._commands.get_nowait()
+            await self._handle(command, args, future, queued)
+
+    async def _handle(self, command, args, future, queued):
+        try:
+            if self._killed and future and command != 'kill':
+                raise Exception('player has been killed!')
+            result = await getattr(self, '_on_{}'.format(command))(*args)
+        except Exception as e:
+            if future:
+                future.set_exception(e)
+            else:
+                self._guild._bot.log.error('error while handling {}'.format(command))
+                self._guild._bot.log.error(traceback.format_exc())
+        else:
+            if future:
+                future.set_result(result)
+        self._stats.record_command(perf_counter() - queued)
 
     @property
     def volume(self):
@@ -222,259 +883,543 @@ class Player:
     @volume.setter
     def volume(self, val):
         self._volume = val
-        async def set_if_source():
-            async with self._aiolocks['player']:
-                if self._source:
-                    self._source._source.volume = val
-        create_task(set_if_source())
+        if not self._killed:
+            self._post('volume', val)
 
     async def status(self):
-        async with self._aiolocks['player']:
-            return self.state
+        return self.state
 
     async def set_playlist(self, playlist: Optional[Playlist]):
-        async with self._aiolocks['playlist']:
-            self._playlist = playlist
+        await self._call('set_playlist', playlist)
 
     async def get_playlist(self):
-        async with self._aiolocks['playlist']:
-            return self._playlist
-
-    async def _play(self, *, play_wait_cb = None, play_success_cb = None):
-        async with self._aiolocks['playtask']:
-            async with self._aiolocks['player']:
-                self.state = PlayerState.WAITING
-                self._current = None
-            entry = None
-            while not entry:
-                try:
-                    async with self._aiolocks['playlist']:
-                        entry, cache = await self._playlist._get_entry()
-                        async with self._aiolocks['player']:
-                            self.state = PlayerState.DOWNLOADING
-                            self._guild._bot.log.debug('got entry...')
-                            self._guild._bot.log.debug(str(entry))
-                            self._guild._bot.log.debug(str(cache))
-                            self._current = entry
-                except (TypeError, AttributeError):
-                    if play_wait_cb:
-                        play_wait_cb()
-                        play_wait_cb = None
-                        play_success_cb = None
-                    await sleep(1)                 
-
-            if play_success_cb:
-                play_success_cb()
+        return self._playlist
+
+    async def _wait_for_entry(self, playlist):
+        if playlist:
+            await playlist.wait_for_entry()
+        else:
+            # nothing to wait on until set_playlist cancels this
+            await get_event_loop().create_future()
+
+    def _start_fetch(self, *, play_success_cb = None, play_wait_cb = None, pause = False):
+        self._fetch_token += 1
+        self.state = PlayerState.WAITING
+        self._current = None
+        self._pause_pending = pause
+        self._fetch_task = create_task(self._fetch(self._fetch_token, self._playlist, play_success_cb, play_wait_cb))
+
+    async def _stop_fetch(self):
+        self._fetch_token += 1
+        if self._fetch_task:
+            self._fetch_task.cancel()
+            try:
+                await self._fetch_task
+            except:
+                pass
+            self._fetch_task = None
+
+    async def _fetch(self, token, playlist, play_success_cb, play_wait_cb):
+        entry = None
+        try:
+            got = await playlist._get_entry() if playlist else None
+            while not got:
+                if play_wait_cb:
+                    play_wait_cb()
+                    play_wait_cb = None
+                    play_success_cb = None
+                await self._wait_for_entry(playlist)
+                got = await playlist._get_entry()
+
+            entry, cache = got
+            self._guild._bot.log.debug('got entry...')
+            self._guild._bot.log.debug(str(entry))
+            self._guild._bot.log.debug(str(cache))
+            self._post('fetched', token, entry)
+        except CancelledError:
+            if entry:
+                await playlist.add_entry(entry, head = True)
+            raise
 
-            def _playback_finished(error = None):
-                async def _async_playback_finished():
-                    async with self._aiolocks['player']:
-                        self._current = None
-                        self._player = None
-                        self._source = None
+        if play_success_cb:
+            play_success_cb()
 
-                    if error:
-                        raise error # pylint: disable=raising-bad-type
+        # from here on the entry belongs to the player, so the download is left running on cancel
+        try:
+            self._guild._bot.log.debug('waiting for cache...')
+            await shield(cache)
+            self._guild._bot.log.debug('finish cache...')
+        except CancelledError:
+            raise
+        except:
+            self._guild._bot.log.error('cannot cache...')
+            self._guild._bot.log.error(traceback.format_exc())
+            self._post('cached', token, entry, False)
+            return
+        self._post('cached', token, entry, True)
+
+    async def _on_fetched(self, token, entry):
+        if token != self._fetch_token:
+            if self._playlist:
+                await self._playlist.add_entry(entry, head = True)
+            return
+        self.state = PlayerState.DOWNLOADING
+        self._current = entry
+
+    async def _on_cached(self, token, entry, cached):
+        if token != self._fetch_token:
+            return
+        self._fetch_task = None
+        if not cached:
+            self._start_fetch(pause = self._pause_pending)
+            return
+
+        source = self._create_counted_source(entry, started = perf_counter())
+        self._player = self._guild._voice_client
+        self._gapless = GaplessSource(source, self._post_threadsafe('swapped'))
+        self._source = source
+        self._player.play(self._gapless, after = self._post_threadsafe('finished', self._gapless))
+        self.state = PlayerState.PLAYING
+        if self._pause_pending:
+            self._pause_pending = False
+            self._player.pause()
+            self.state = PlayerState.PAUSE
+        self._start_lookahead()
+
+    async def _on_finished(self, gapless, error = None):
+        if gapless is not self._gapless:
+            return
+        await self._stop_lookahead()
+        paused = self.state == PlayerState.PAUSE
+        self._current = None
+        self._player = None
+        self._source = None
+        self._gapless = None
 
-                    create_task(self._play())  
+        if error:
+            self._guild._bot.log.error('playback stopped with an error: {}'.format(error))
 
-                future = run_coroutine_threadsafe(_async_playback_finished(), self._guild._bot.loop)
-                future.result()
+        if not self._killed:
+            self._start_fetch(pause = paused)
 
-            async def _download_and_play():
+    async def _on_swapped(self, source):
+        if not self._gapless:
+            return
+        # sources carry their entry, the swap may have happened before a seek or skip was handled
+        self._current = source.entry
+        if self._next_entry is source.entry:
+            self._next_entry = None
+        self._source = source
+        self._guild._bot.log.debug('swapped to {}'.format(self._current))
+        self._start_lookahead()
+
+    def _start_lookahead(self):
+        self._lookahead_token += 1
+        self._lookahead_task = create_task(
+            self._prepare_next(self._lookahead_token, self._playlist, self._current, self._source)
+        )
+
+    async def _prepare_next(self, token, playlist, current, current_source):
+        '''
+        pop the next entry and spawn its source shortly before current ends, so that
+        gapless can swap to it without a gap
+        '''
+        if not current.duration:
+            return
+
+        remaining = current.duration - current_source.get_progress()
+        while remaining > self._lookahead:
+            # progress does not advance while paused, so check again after sleeping
+            await sleep(remaining - self._lookahead)
+            remaining = current.duration - current_source.get_progress()
+
+        entry = None
+        try:
+            while True:
+                # the entry stays queued while it downloads, so that it can still be seen and removed
+                got = await playlist._peek_entry() if playlist else None
+                if not got:
+                    await self._wait_for_entry(playlist)
+                    continue
+
+                head, cache = got
                 try:
-                    self._guild._bot.log.debug('waiting for cache...')
-                    await cache
-                    self._guild._bot.log.debug('finish cache...')
+                    # the download belongs to the entry, stopping the lookahead must not cancel it
+                    await shield(cache)
+                except CancelledError:
+                    raise
                 except:
                     self._guild._bot.log.error('cannot cache...')
                     self._guild._bot.log.error(traceback.format_exc())
-                    async with self._aiolocks['player']:
-                        if self.state != PlayerState.PAUSE:
-                            await self._play()                    
-
-                boptions = "-nostdin"
-                aoptions = "-vn"
-
-                self._guild._bot.log.debug("Creating player with options: {} {} {}".format(boptions, aoptions, entry._local_url))
-
-                source = SourcePlaybackCounter(
-                    PCMVolumeTransformer(
-                        FFmpegPCMAudio(
-                            entry._local_url,
-                            before_options=boptions,
-                            options=aoptions,
-                            stderr=subprocess.PIPE
-                        ),
-                        self._volume
-                    )
-                )
+                    await playlist._take_entry(head)
+                    continue
 
-                async with self._aiolocks['player']:
-                    self._player = self._guild._voice_client
-                    self._guild._voice_client.play(source, after=_playback_finished)
-                    self._source = source
-                    self.state = PlayerState.PLAYING
-        
-            self._play_task = create_task(_download_and_play())
+                if not await playlist._take_entry(head):
+                    continue
+                entry = head
+                self._post('popped', token, entry)
 
-        try:
-            self._guild._bot.log.debug('waiting for task to play...')
-            await self._play_task
-        except CancelledError:
-            async with self._aiolocks['player']:
-                if self.state != PlayerState.PAUSE:
-                    await self._play()
-
-    async def _play_safe(self, *callback, play_wait_cb = None, play_success_cb = None):
-        async with self._aiolocks['playsafe']:
-            if not self._play_safe_task:
-                task = create_task(self._play(play_wait_cb = play_wait_cb, play_success_cb = play_success_cb))
-                def clear_play_safe_task(future):
-                    self._play_safe_task = None
-                task.add_done_callback(clear_play_safe_task)
-
-                for cb in callback:
-                    task.add_done_callback(callback_dummy_future(cb))
-            else:
+                offset = entry._resume_offset
+                source = None
+                try:
+                    source, frame = self._create_source(entry, offset)
+                    prefetched = await PrefetchedSource.prefetch(source)
+                except CancelledError:
+                    # an ffmpeg process, an open file or a fanout subscription
+                    if source:
+                        source.cleanup()
+                    raise
+                except:
+                    if source:
+                        source.cleanup()
+                    self._guild._bot.log.error('cannot prepare {}'.format(entry))
+                    self._guild._bot.log.error(traceback.format_exc())
+                    # the entry is played the usual way once current ends
+                    await playlist.add_entry(entry, head = True)
+                    self._post('popped', token, None)
+                    return
+                entry._resume_offset = 0
+                self._stats.record_startup(prefetched.startup)
+                source = SourcePlaybackCounter(prefetched, frame, entry = entry, stats = self._stats, expected = entry.duration)
+                self._post('prepared', token, entry, source)
                 return
+        except CancelledError:
+            if entry:
+                await playlist.add_entry(entry, head = True)
+            raise
+
+    async def _on_popped(self, token, entry):
+        if token == self._lookahead_token:
+            self._next_entry = entry
+
+    async def _on_prepared(self, token, entry, source):
+        if token != self._lookahead_token or not self._gapless:
+            source.cleanup()
+            if self._playlist:
+                await self._playlist.add_entry(entry, head = True)
+            return
+        self._next_entry = entry
+        self._gapless.set_next(source)
+        self._guild._bot.log.debug('prepared next entry {}'.format(entry))
+
+    async def _stop_lookahead(self):
+        self._lookahead_token += 1
+        if self._lookahead_task:
+            self._lookahead_task.cancel()
+            try:
+                await self._lookahead_task
+            except:
+                pass
+            self._lookahead_task = None
+
+        self._next_entry = None
+        source = self._gapless.take_next() if self._gapless else None
+        if source:
+            source.cleanup()
+            # a pending seek holds the current entry, which is not taken out of the playlist
+            if source.entry is not self._current and self._playlist:
+                await self._playlist.add_entry(source.entry, head = True)
+
+    def _create_source(self, entry, offset = 0):
+        '''
+        source for entry starting offset seconds in and the frame it actually starts at, the
+        decode is shared with other players reading the same entry from about the same frame
+        '''
+        volume = self._volume * entry._gain
+        live = entry.is_live
+
+        def before_options(offset):
+            if offset:
+                # input seeking, ffmpeg jumps using the container index instead of decoding up to offset
+                return '-nostdin -ss {}'.format(offset)
+            return '-nostdin'
+
+        if self._passthrough and entry._opus_url:
+            # the file has the loudness gain and the default volume baked in, so only
+            # players that differ from that have to decode and encode it again
+            volume = self._volume * entry._gain / entry._opus_volume
+            if isclose(volume, 1.0) and (entry._opus_index or not offset):
+                def create(offset):
+                    # packets are forwarded as is, nothing gets decoded
+                    self._guild._bot.log.debug("Creating opus passthrough player at {}s: {}".format(offset, entry._opus_url))
+                    return OggOpusSource(entry._opus_url, entry._opus_index, offset)
+                return self._share((entry._opus_url, 'ogg'), offset, create, live)
+
+            # gain is applied and encoded by ffmpeg instead of in the bot process
+            aoptions = '-vn -filter:a volume={}'.format(volume)
+            key = (entry._opus_url, 'opus', volume)
+            def create(offset):
+                if self._segments:
+                    cached = self._segments.open(key, offset)
+                    if cached:
+                        self._guild._bot.log.debug("Playing {} at {}s from the hot track cache".format(entry._opus_url, offset))
+                        return cached
+                self._guild._bot.log.debug("Creating opus player with options: {} {} {}".format(before_options(offset), aoptions, entry._opus_url))
+                source = FFmpegOpusAudio(
+                    entry._opus_url,
+                    before_options=before_options(offset),
+                    options=aoptions,
+                    stderr=subprocess.PIPE
+                )
+                if self._segments and not offset:
+                    source = self._segments.record(key, source, entry.duration)
+                return source
+            return self._share(key, offset, create, live)
+
+        def create(offset):
+            boptions = before_options(offset)
+            if live:
+                # ffmpeg rides out short network errors on its own before the stream gets reopened
+                boptions = '{} -reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -rw_timeout 10000000'.format(boptions)
+            self._guild._bot.log.debug("Creating player with options: {} {} {}".format(boptions, '-vn', entry._local_url))
+            return FFmpegPCMAudio(
+                entry._local_url,
+                before_options=boptions,
+                options='-vn',
+                stderr=subprocess.PIPE
+            )
+
+        if live:
+            open_stream = create
+            loop = self._guild._bot.loop
+            def refresh():
+                run_coroutine_threadsafe(entry.refresh(), loop).result()
+            def create(offset):
+                return BufferedStreamSource(open_stream, offset, refresh = refresh, stats = self._stats)
+
+        # streams resolve to a different url every time, so they are shared by their page
+        source, frame = self._share((entry.source_url if live else entry._local_url, 'pcm'), offset, create, live)
+        # volume is applied after the shared decode, so every player keeps its own
+        return PCMVolumeTransformer(source, volume), frame
+
+    def _share(self, key, offset, create, live):
+        if not self._fanout:
+            return create(offset), int(offset / 0.02)
+        cursor = self._fanout.subscribe(key, offset, create, live = live)
+        return cursor, cursor.frame
+
+    def _create_counted_source(self, entry, **kwargs):
+        offset, entry._resume_offset = entry._resume_offset, 0
+        source, frame = self._create_source(entry, offset)
+        return SourcePlaybackCounter(
+            source,
+            frame,
+            entry = entry,
+            stats = self._stats,
+            expected = entry.duration,
+            **kwargs
+        )
 
     async def play(self, *, play_fail_cb = None, play_success_cb = None, play_wait_cb = None):
-        async with self._aiolocks['play']:
-            async with self._aiolocks['player']:
-                if self.state != PlayerState.PAUSE:
-                    exc = Exception('player is not paused')
-                    if play_fail_cb:
-                        play_fail_cb(exc)
-                    else:
-                        raise exc
-                    return
+        await self._call('play', play_fail_cb, play_success_cb, play_wait_cb)
 
-                if self._player:
-                    self.state = PlayerState.PLAYING
-                    self._player.resume()
-                    play_success_cb()
-                    return
+    async def _on_play(self, play_fail_cb, play_success_cb, play_wait_cb):
+        if self.state == PlayerState.DOWNLOADING and self._pause_pending:
+            self._pause_pending = False
+            if play_success_cb:
+                play_success_cb()
+            return
 
-                await self._play_safe(play_wait_cb = play_wait_cb, play_success_cb = play_success_cb)
+        if self.state != PlayerState.PAUSE:
+            exc = Exception('player is not paused')
+            if play_fail_cb:
+                play_fail_cb(exc)
+            else:
+                raise exc
+            return
 
-    async def _pause(self):
-        async with self._aiolocks['player']:
-            if self.state != PlayerState.PAUSE:
-                if self._player:
-                    self._player.pause()
-                    self.state = PlayerState.PAUSE
+        if self._player:
+            self.state = PlayerState.PLAYING
+            self._player.resume()
+            if play_success_cb:
+                play_success_cb()
+            return
+
+        self._start_fetch(play_success_cb = play_success_cb, play_wait_cb = play_wait_cb)
 
     async def pause(self):
-        async with self._aiolocks['pause']:
-            async with self._aiolocks['player']:
-                if self.state == PlayerState.PAUSE:
-                    return
+        await self._call('pause')
 
-                elif self.state == PlayerState.PLAYING:
-                    self._player.pause()
-                    self.state = PlayerState.PAUSE
-                    return
+    async def _on_pause(self):
+        if self.state == PlayerState.PLAYING:
+            self._player.pause()
+            self.state = PlayerState.PAUSE
 
-                elif self.state == PlayerState.DOWNLOADING or self.state == PlayerState.WAITING:
-                    async with self._aiolocks['playtask']:
-                        self._play_task.add_done_callback(
-                            callback_dummy_future(
-                                partial(create_task, self._pause())
-                            )
-                        )
-                    return
-        
+        elif self.state == PlayerState.DOWNLOADING:
+            # paused as soon as the entry starts
+            self._pause_pending = True
 
-    async def skip(self):
-        async with self._aiolocks['skip']:
-            async with self._aiolocks['player']:
-                if self.state == PlayerState.PAUSE:
-                    await self._play_safe(partial(create_task, self._pause()))
-                    return
+        elif self.state == PlayerState.WAITING:
+            await self._stop_fetch()
+            self.state = PlayerState.PAUSE
 
-                elif self.state == PlayerState.PLAYING:
-                    self._player.stop()
-                    return
+    async def skip(self):
+        await self._call('skip')
+
+    async def _on_skip(self):
+        if self.state == PlayerState.PAUSE:
+            if not self._gapless:
+                raise Exception('nothing to skip!')
+            # the next entry is fetched and stays paused once playback finishes
+            self._player.stop()
+
+        elif self.state == PlayerState.PLAYING:
+            if self._gapless.skip():
+                # next entry is already warm, swap to it on the next frame
+                return
+            self._player.stop()
 
-                elif self.state == PlayerState.DOWNLOADING:
-                    async with self._aiolocks['playtask']:
-                        self._play_task.cancel()
-                    return
+        elif self.state == PlayerState.DOWNLOADING:
+            await self._stop_fetch()
+            self._start_fetch(pause = self._pause_pending)
 
-                elif self.state == PlayerState.WAITING:
-                    raise Exception('nothing to skip!')
+        elif self.state == PlayerState.WAITING:
+            raise Exception('nothing to skip!')
     
-    async def kill(self):
-        async with self._aiolocks['kill']:
-            # TODO: destruct
-            pass
+    async def seek(self, seconds):
+        '''
+        restart the current entry at seconds, through the same swap that gapless playback uses
+        '''
+        await self._call('seek', seconds)
+
+    async def _on_seek(self, seconds):
+        if self.state not in (PlayerState.PLAYING, PlayerState.PAUSE) or not self._gapless or not self._current:
+            raise Exception('not playing!')
+        entry = self._current
+
+        if not entry.duration:
+            raise Exception('cannot seek in a stream!')
+        if not 0 <= seconds < entry.duration:
+            raise Exception('cannot seek outside of the entry!')
+
+        await self._stop_lookahead()
+
+        entry._resume_offset = seconds
+        self._gapless.set_next(self._create_counted_source(entry))
+        self._gapless.skip()
+
+    async def _on_volume(self, val):
+        if not self._source:
+            return
+        transformer = _volume_transformer(self._source)
+        if not transformer:
+            # opus sources get their gain from ffmpeg, so reopen at the current position,
+            # which prepares the next entry again as well
+            try:
+                await self._on_seek(self._source.get_progress())
+            except Exception as e:
+                self._guild._bot.log.debug('cannot apply volume by reopening source: {}'.format(e))
+            return
+
+        transformer.volume = val * (self._current._gain if self._current else 1.0)
+        prepared = self._gapless.next if self._gapless else None
+        # a pending seek is about to be swapped in and keeps the volume it was opened with
+        if not prepared or prepared.entry is self._current:
+            return
+        transformer = _volume_transformer(prepared)
+        if transformer:
+            transformer.volume = val * prepared.entry._gain
+        else:
+            await self._stop_lookahead()
+            self._start_lookahead()
+
+    async def _on_set_playlist(self, playlist):
+        self._playlist = playlist
+        # helper tasks wait on the playlist they were started with
+        if self.state == PlayerState.WAITING:
+            await self._stop_fetch()
+            self._start_fetch(pause = self._pause_pending)
+        if self._lookahead_task and not self._next_entry:
+            await self._stop_lookahead()
+            self._start_lookahead()
 
-    async def progress(self):
-        async with self._aiolocks['player']:
-            if self._source:
-                return self._source.get_progress()
-            else:
-                raise Exception('not playing!')
+    async def kill(self):
+        '''
+        stop the player for good, the current entry goes back to the head of the playlist
+        and resumes where it left off on the next player of the playlist
+        '''
+        await self._call('kill')
+        await self._actor
+
+    async def _on_kill(self):
+        self._killed = True
+        await self._stop_fetch()
+        await self._stop_lookahead()
+
+        entry, source, gapless, player = self._current, self._source, self._gapless, self._player
+        if gapless:
+            # the voice thread may have swapped to a source the player has not been told about yet
+            source = gapless.source
+            entry = source.entry
+        self._current = None
+        self._source = None
+        self._gapless = None
+        self._player = None
+        self.state = PlayerState.PAUSE
 
-    async def estimate_time_until(self, position):
-        async with self._aiolocks['playlist']:
-            future = None
-            async with self._aiolocks['player']:
-                if self.state == PlayerState.DOWNLOADING:
-                    self._guild._bot.log.debug('scheduling estimate time after current entry is playing')
-                    future = Future()
-                    async def call_after_downloaded():
-                        future.set_result(await self.estimate_time_until(position))
-                    self._play_task.add_done_callback(
-                        callback_dummy_future(
-                            partial(create_task, call_after_downloaded())
-                        )
-                    )
-                if self._current:
-                    estimated_time = self._current.duration
-                if self._source:
-                    estimated_time -= self._source.get_progress()
+        if player:
+            player.stop()
+        if gapless:
+            gapless.cleanup()
 
-            if future:
-                estimated_time = await future
+        if entry and self._playlist:
+            if source and entry.duration:
+                entry._resume_offset = source.get_progress()
+            await self._playlist.add_entry(entry, head = True)
 
-            estimated_time = timedelta(seconds=estimated_time)
+    async def progress(self):
+        if self._source:
+            return self._source.get_progress()
+        else:
+            raise Exception('not playing!')
+
+    def _time_ahead(self):
+        '''
+        seconds until the head of the playlist starts playing
+        '''
+        estimated_time = 0
+        if self._current:
+            estimated_time = self._current.duration
+        if self._source:
+            estimated_time -= self._source.get_progress()
+        if self._next_entry:
+            estimated_time += self._next_entry.duration
+        return estimated_time
 
-            estimated_time += await self._playlist.estimate_time_until(position)
-            return estimated_time
+    async def estimate_time_until(self, position):
+        estimated_time = timedelta(seconds=self._time_ahead())
+        estimated_time += await self._playlist.estimate_time_until(position)
+        return estimated_time
 
     async def estimate_time_until_entry(self, entry):
-        async with self._aiolocks['playlist']:
-            future = None
-            async with self._aiolocks['player']:
-                if self.state == PlayerState.DOWNLOADING:
-                    self._guild._bot.log.debug('scheduling estimate time after current entry is playing')
-                    future = Future()
-                    async def call_after_downloaded():
-                        future.set_result(await self.estimate_time_until_entry(entry))
-                    self._play_task.add_done_callback(
-                        callback_dummy_future(
-                            partial(create_task, call_after_downloaded())
-                        )
-                    )
-                if self._current is entry:
-                    return 0
-                if self._current:
-                    estimated_time = self._current.duration
-                    if self._source:
-                        estimated_time -= self._source.get_progress()
-                else:
-                    estimated_time = 0
-
-            if future:
-                estimated_time = await future
-
-            estimated_time = timedelta(seconds=estimated_time)
-                
-            estimated_time += await self._playlist.estimate_time_until_entry(entry)
-            return estimated_time
+        if self._current is entry:
+            return 0
+        if self._next_entry is entry:
+            return timedelta(seconds=self._time_ahead() - entry.duration)
+        estimated_time = timedelta(seconds=self._time_ahead())
+        estimated_time += await self._playlist.estimate_time_until_entry(entry)
+        # an entry cannot start before its download has finished
+        return max(estimated_time, timedelta(seconds=entry.download_eta()))
+
+    def playback_stats(self):
+        '''
+        snapshot of frame timing statistics since the player was created or last reset
+        '''
+        stats = self._stats.snapshot()
+        if self._fanout:
+            stats['shared'] = self._fanout.stats()
+        if self._segments:
+            stats['hot_tracks'] = self._segments.stats()
+        return stats
+
+    def reset_playback_stats(self):
+        self._stats.reset()
 
     async def get_current_entry(self):
-        async with self._aiolocks['player']:
-            return self._current
\ No newline at end of file
+        return self._current
+
+    async def get_loaded_entries(self):
+        '''
+        entries the player took out of its playlist, the current one and the one prepared after it
+        '''
+        return [entry for entry in (self._current, self._next_entry) if entry]
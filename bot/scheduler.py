@@ -0,0 +1,146 @@
+"""
+ModuBot: A modular discord bot with dependency management
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The MIT License (MIT)
+
+Copyright (c) 2019 TheerapakG
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from asyncio import Future, create_task
+from collections import defaultdict
+from enum import IntEnum
+from heapq import heappush, heappop
+from itertools import count
+
+class CachePriority(IntEnum):
+    PLAYING = 0
+    PRECACHE = 1
+
+class _CacheJob:
+    def __init__(self, entry, priority, group):
+        self.entry = entry
+        self.priority = priority
+        self.group = group
+        self.future = Future()
+        self.task = None
+
+class CacheScheduler:
+    '''
+    runs Entry.prepare_cache for every playlist with bounded concurrency
+
+    lower priority value runs first: CachePriority.PLAYING is an entry a player is waiting
+    for, CachePriority.PRECACHE + n is the n-th precache slot of a playlist. at most
+    max_concurrent jobs run at once and at most max_per_group from the same group
+    (playlist), with `reserved` of the global slots kept for CachePriority.PLAYING so
+    that next-up entries never queue behind bulk precaching
+    '''
+    def __init__(self, max_concurrent = 4, max_per_group = 2, reserved = 1):
+        self.max_concurrent = max_concurrent
+        self.max_per_group = max_per_group
+        self.reserved = reserved
+        self._pending = list()
+        self._seq = count()
+        self._jobs = dict()
+        self._running = 0
+        self._running_group = defaultdict(int)
+
+    def schedule(self, entry, priority = CachePriority.PRECACHE, group = None) -> Future:
+        '''
+        schedule entry to be cached and return a future that resolves when it is
+
+        scheduling an entry that is already scheduled only raises its priority.
+        cancelling the returned future removes the job, or cancels it if it is running
+        '''
+        job = self._jobs.get(id(entry))
+        if job:
+            if priority < job.priority and not job.task:
+                job.priority = priority
+                heappush(self._pending, (priority, next(self._seq), job))
+                self._dispatch()
+            return job.future
+
+        job = _CacheJob(entry, priority, group)
+        self._jobs[id(entry)] = job
+        job.future.add_done_callback(lambda future: self._on_future_done(job))
+        heappush(self._pending, (priority, next(self._seq), job))
+        self._dispatch()
+        return job.future
+
+    def cancel(self, entry):
+        job = self._jobs.get(id(entry))
+        if job:
+            job.future.cancel()
+
+    def stats(self):
+        return {
+            'running': self._running,
+            'pending': len(self._jobs) - self._running,
+            'running_per_group': dict(self._running_group)
+        }
+
+    def _on_future_done(self, job):
+        if self._jobs.get(id(job.entry)) is job:
+            del self._jobs[id(job.entry)]
+        if job.future.cancelled() and job.task:
+            job.task.cancel()
+
+    def _can_run(self, job):
+        if self._running_group.get(job.group, 0) >= self.max_per_group and job.priority != CachePriority.PLAYING:
+            return False
+        if job.priority == CachePriority.PLAYING:
+            return self._running < self.max_concurrent
+        return self._running < self.max_concurrent - self.reserved
+
+    def _dispatch(self):
+        skipped = list()
+        while self._pending and self._running < self.max_concurrent:
+            item = heappop(self._pending)
+            _, _, job = item
+            if job.task or job.future.done() or item[0] != job.priority:
+                continue
+            if not self._can_run(job):
+                skipped.append(item)
+                continue
+            self._start(job)
+        for item in skipped:
+            heappush(self._pending, item)
+
+    def _start(self, job):
+        self._running += 1
+        self._running_group[job.group] += 1
+        job.task = create_task(job.entry.prepare_cache())
+        job.task.add_done_callback(lambda task: self._on_task_done(job))
+
+    def _on_task_done(self, job):
+        self._running -= 1
+        self._running_group[job.group] -= 1
+        if not self._running_group[job.group]:
+            del self._running_group[job.group]
+
+        if not job.future.done():
+            if job.task.cancelled():
+                job.future.cancel()
+            elif job.task.exception():
+                job.future.set_exception(job.task.exception())
+            else:
+                job.future.set_result(job.task.result())
+
+        self._dispatch()
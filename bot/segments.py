@@ -0,0 +1,238 @@
+"""
+ModuBot: A modular discord bot with dependency management
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The MIT License (MIT)
+
+Copyright (c) 2019 TheerapakG
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from array import array
+from collections import Counter, OrderedDict
+from discord import AudioSource
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+_footer = struct.Struct('<I4s')
+_magic = b'SEG1'
+
+class SegmentSource(AudioSource):
+    '''
+    plays opus frames from a segment file, frames are handed out as views into the mapped
+    file so nothing is copied or decoded
+    '''
+    def __init__(self, path, offset = 0):
+        with open(path, 'rb') as fp:
+            self._map = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+        count, magic = _footer.unpack_from(self._map, len(self._map) - _footer.size)
+        if magic != _magic:
+            self._map.close()
+            raise Exception('{} is not a segment file'.format(path))
+        start = len(self._map) - _footer.size - 4 * (count + 1)
+        self._offsets = array('I')
+        self._offsets.frombytes(self._map[start:start + 4 * (count + 1)])
+        self._view = memoryview(self._map)
+        self._frame = min(int(offset / 0.02), count)
+
+    def read(self):
+        if self._frame + 1 >= len(self._offsets):
+            return b''
+        data = self._view[self._offsets[self._frame]:self._offsets[self._frame + 1]]
+        self._frame += 1
+        return data
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self._view = None
+        try:
+            self._map.close()
+        except BufferError:
+            # frames are still referenced somewhere, the mapping goes away with the last of them
+            pass
+
+class _SegmentRecorder(AudioSource):
+    '''
+    passes the frames of source through while writing them into a segment file, which is
+    only kept if source played until its end
+    '''
+    def __init__(self, cache, name, source, duration):
+        self._cache = cache
+        self._name = name
+        self._source = source
+        self._duration = duration
+        self._part = '{}.part'.format(cache._path(name))
+        self._file = open(self._part, 'wb')
+        self._offsets = array('I', [0])
+
+    def read(self):
+        data = self._source.read()
+        if self._file:
+            if not data:
+                self._finish()
+            elif self._offsets[-1] + len(data) > self._cache.max_size // 4:
+                self._discard()
+            else:
+                self._file.write(data)
+                self._offsets.append(self._offsets[-1] + len(data))
+        return data
+
+    def _finish(self):
+        frames = len(self._offsets) - 1
+        if not frames or (self._duration and frames * 0.02 < self._duration - 2):
+            # ffmpeg stopped early, a truncated segment would be replayed as is
+            self._discard()
+            return
+        self._file.write(self._offsets.tobytes())
+        self._file.write(_footer.pack(frames, _magic))
+        self._file.close()
+        self._file = None
+        os.replace(self._part, self._cache._path(self._name))
+        self._cache._add(self._name)
+
+    def _discard(self):
+        self._file.close()
+        self._file = None
+        os.remove(self._part)
+        self._cache._recording.discard(self._name)
+
+    def is_opus(self):
+        return self._source.is_opus()
+
+    def cleanup(self):
+        self._source.cleanup()
+        if self._file:
+            self._discard()
+
+class SegmentCache:
+    '''
+    keeps the encoded opus frames of tracks that are played often as segment files in
+    folder, so that playing them again needs neither ffmpeg nor any decoding
+
+    a track is recorded while it is played from the start for the hot_after-th time, the
+    least recently played segments are removed once all of them take more than max_size
+    bytes. until configure is called the cache does nothing
+    '''
+    def __init__(self):
+        self.folder = None
+        self.max_size = 0
+        self.hot_after = 2
+        self._plays = Counter()
+        self._segments = OrderedDict()
+        self._recording = set()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def configure(self, folder, max_size, hot_after = 2):
+        self.folder = folder
+        self.max_size = max_size
+        self.hot_after = hot_after
+        os.makedirs(folder, exist_ok = True)
+
+        found = list()
+        for fname in os.listdir(folder):
+            path = os.path.join(folder, fname)
+            if fname.endswith('.part'):
+                os.remove(path)
+            elif fname.endswith('.seg'):
+                found.append((os.path.getmtime(path), fname[:-len('.seg')], os.path.getsize(path)))
+
+        with self._lock:
+            self._segments.clear()
+            self._size = 0
+            for _, name, size in sorted(found):
+                self._segments[name] = size
+                self._size += size
+        self._evict()
+
+    def _path(self, name):
+        return os.path.join(self.folder, '{}.seg'.format(name))
+
+    @staticmethod
+    def _name(key):
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def open(self, key, offset = 0):
+        '''
+        source playing the cached segment of key from offset seconds, None if there is none
+        '''
+        if not self.folder:
+            return None
+        name = self._name(key)
+        with self._lock:
+            if name not in self._segments:
+                return None
+            self._segments.move_to_end(name)
+        try:
+            os.utime(self._path(name))
+            return SegmentSource(self._path(name), offset)
+        except Exception:
+            with self._lock:
+                self._size -= self._segments.pop(name, 0)
+            return None
+
+    def record(self, key, source, duration = None):
+        '''
+        count a play of key from the start with source, which is returned wrapped so that it
+        gets recorded into a segment once the track is hot
+        '''
+        if not self.folder or not source.is_opus():
+            return source
+        name = self._name(key)
+        with self._lock:
+            if len(self._plays) > 4096:
+                # forget the tracks that were only played once in a while
+                self._plays = Counter(dict(self._plays.most_common(1024)))
+            self._plays[name] += 1
+            if self._plays[name] < self.hot_after or name in self._segments or name in self._recording:
+                return source
+            self._recording.add(name)
+        return _SegmentRecorder(self, name, source, duration)
+
+    def _add(self, name):
+        size = os.path.getsize(self._path(name))
+        with self._lock:
+            self._recording.discard(name)
+            self._plays.pop(name, None)
+            self._segments[name] = size
+            self._size += size
+        self._evict()
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if self._size <= self.max_size or not self._segments:
+                    return
+                name, size = self._segments.popitem(last = False)
+                self._size -= size
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {'segments': len(self._segments), 'size': self._size}
+
+hot_tracks = SegmentCache()
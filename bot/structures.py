@@ -0,0 +1,252 @@
+"""
+ModuBot: A modular discord bot with dependency management
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The MIT License (MIT)
+
+Copyright (c) 2019 TheerapakG
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from typing import Any, Callable, Iterable, Optional, Union
+
+class FenwickTree:
+    '''
+    binary indexed tree over a fixed number of slots, supporting point update,
+    prefix sum and prefix search in O(log n)
+    '''
+    def __init__(self, size_or_values: Union[int, Iterable] = 0):
+        if isinstance(size_or_values, int):
+            self._tree = [0] * (size_or_values + 1)
+        else:
+            self._build(list(size_or_values))
+
+    def _build(self, values):
+        tree = [0] + values
+        size = len(values)
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def __len__(self):
+        return len(self._tree) - 1
+
+    def add(self, index, delta):
+        '''
+        add delta to the value at index
+        '''
+        index += 1
+        size = len(self._tree)
+        while index < size:
+            self._tree[index] += delta
+            index += index & -index
+
+    def prefix(self, end):
+        '''
+        sum of values in [0, end)
+        '''
+        total = 0
+        while end > 0:
+            total += self._tree[end]
+            end -= end & -end
+        return total
+
+    def total(self):
+        return self.prefix(len(self))
+
+    def search(self, target):
+        '''
+        smallest index i such that prefix(i + 1) > target, assuming all values are non-negative
+        returns len(self) if there is no such index
+        '''
+        pos = 0
+        step = 1 << (len(self).bit_length())
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= target:
+                pos = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        return pos
+
+class IndexedQueue:
+    '''
+    sequence stored as a list of bounded blocks with the size and the total weight of
+    each block kept in fenwick trees
+
+    index of item and item at position are O(log n + b) where b is the block size, slices
+    are O(log n + k). insert and delete are O(log n + b) as well, plus O(n / b) to rebuild
+    the trees whenever a block is split or dropped, which is once every b operations at
+    most. item must be hashable by identity and appear in the queue at most once
+    '''
+    _load = 256
+
+    def __init__(self, iterable: Iterable = (), *, weight: Optional[Callable[[Any], Any]] = None):
+        self._weight = weight if weight else lambda item: 0
+        self.rebuild(iterable)
+
+    def rebuild(self, iterable: Iterable):
+        items = list(iterable)
+        self._len = len(items)
+        self._blocks = [items[i:i + self._load] for i in range(0, len(items), self._load)]
+        self._block_of = dict()
+        for block in self._blocks:
+            for item in block:
+                self._block_of[id(item)] = block
+        # total weight of each block, so that rebuilding the trees never weighs every item
+        self._sums = [sum(self._weight(item) for item in block) for block in self._blocks]
+        self._reindex_blocks()
+
+    def _reindex_blocks(self):
+        self._block_index = {id(block): i for i, block in enumerate(self._blocks)}
+        self._counts = FenwickTree([len(block) for block in self._blocks])
+        self._weights = FenwickTree(self._sums)
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+
+    def __contains__(self, item):
+        return id(item) in self._block_of
+
+    def _normalize(self, position):
+        if position < 0:
+            position += self._len
+        if not 0 <= position < self._len:
+            raise IndexError('queue index out of range')
+        return position
+
+    def _locate(self, position):
+        bidx = self._counts.search(position)
+        return bidx, position - self._counts.prefix(bidx)
+
+    def __getitem__(self, item: Union[int, slice]):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self._len)
+            if step != 1:
+                return list(self)[item]
+            res = list()
+            if start >= stop:
+                return res
+            bidx, offset = self._locate(start)
+            while len(res) < stop - start:
+                block = self._blocks[bidx]
+                res.extend(block[offset:offset + stop - start - len(res)])
+                bidx += 1
+                offset = 0
+            return res
+        bidx, offset = self._locate(self._normalize(item))
+        return self._blocks[bidx][offset]
+
+    def insert(self, position, item):
+        if position < 0:
+            position = max(0, position + self._len)
+        position = min(position, self._len)
+        if not self._blocks:
+            self._blocks.append(list())
+            self._sums.append(0)
+            self._reindex_blocks()
+        if position == self._len:
+            bidx = len(self._blocks) - 1
+            offset = len(self._blocks[bidx])
+        else:
+            bidx, offset = self._locate(position)
+        block = self._blocks[bidx]
+        block.insert(offset, item)
+        self._block_of[id(item)] = block
+        self._len += 1
+        weight = self._weight(item)
+        self._counts.add(bidx, 1)
+        self._weights.add(bidx, weight)
+        self._sums[bidx] += weight
+        if len(block) > 2 * self._load:
+            half = block[self._load:]
+            del block[self._load:]
+            for moved in half:
+                self._block_of[id(moved)] = half
+            moved_weight = sum(self._weight(moved) for moved in half)
+            self._sums[bidx] -= moved_weight
+            self._blocks.insert(bidx + 1, half)
+            self._sums.insert(bidx + 1, moved_weight)
+            self._reindex_blocks()
+
+    def append(self, item):
+        self.insert(self._len, item)
+
+    def appendleft(self, item):
+        self.insert(0, item)
+
+    def pop(self, position = -1):
+        bidx, offset = self._locate(self._normalize(position))
+        block = self._blocks[bidx]
+        item = block.pop(offset)
+        del self._block_of[id(item)]
+        self._len -= 1
+        weight = self._weight(item)
+        self._counts.add(bidx, -1)
+        self._weights.add(bidx, -weight)
+        self._sums[bidx] -= weight
+        if not block:
+            del self._blocks[bidx]
+            del self._sums[bidx]
+            self._reindex_blocks()
+        return item
+
+    def popleft(self):
+        return self.pop(0)
+
+    def __delitem__(self, position):
+        self.pop(position)
+
+    def index(self, item):
+        block = self._block_of.get(id(item))
+        if block is None:
+            raise ValueError('item is not in queue')
+        bidx = self._block_index[id(block)]
+        return self._counts.prefix(bidx) + next(i for i, other in enumerate(block) if other is item)
+
+    def remove(self, item):
+        self.pop(self.index(item))
+
+    def weight_until(self, position):
+        '''
+        total weight of items in [0, position)
+        '''
+        if position <= 0:
+            return 0
+        if position >= self._len:
+            return self._weights.total()
+        bidx, offset = self._locate(position)
+        return self._weights.prefix(bidx) + sum(self._weight(item) for item in self._blocks[bidx][:offset])
+
+    def weight_until_item(self, item):
+        '''
+        total weight of items before item, or of the whole queue if item is not in it
+        '''
+        if item not in self:
+            return self._weights.total()
+        return self.weight_until(self.index(item))
@@ -25,6 +25,7 @@ DEALINGS IN THE SOFTWARE.
 """
 
 import json
+import multiprocessing
 import os
 import re
 from datetime import timedelta
@@ -87,6 +88,15 @@ def md5sum(filename, limit=0):
             fhash.update(chunk)
     return fhash.hexdigest()[-limit:]
 
+def worker_context():
+    '''
+    multiprocessing context for worker pools, forked workers would inherit the event loop,
+    threads and sockets of the bot in whatever state they are in
+    '''
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
 regex_parse_duration = re.compile(r'^((?P<days>[\.\d]+?)d)?((?P<hours>[\.\d]+?)h)?((?P<minutes>[\.\d]+?)m)?((?P<seconds>[\.\d]+?)s)?$')
 
 def parse_duration(durationstr: str) -> timedelta: